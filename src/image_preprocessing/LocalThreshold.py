@@ -0,0 +1,238 @@
+from __future__ import annotations
+from typing import *
+import numpy as np
+import cv2
+
+ThresholdMethod = int
+BRADLEY_THRESHOLD = 0
+NIBLACK_THRESHOLD = 1
+SAUVOLA_THRESHOLD = 2
+WOLF_THRESHOLD = 3
+
+DEFAULT_K = {
+    BRADLEY_THRESHOLD: 0.15,
+    NIBLACK_THRESHOLD: -0.2,
+    SAUVOLA_THRESHOLD: 0.5,
+    WOLF_THRESHOLD: 0.5
+}
+
+
+class LocalThreshold:
+    """
+    Локальная бинаризация по среднему и стандартному отклонению яркости в окне w_size x w_size (окна обрезаются
+    краями изображения, как в pythreshold): Брэдли-Рот, Ниблэк, Саувола, Вольф. Суммы I и I^2 по окну берутся из
+    таблиц сумм, поэтому стоимость на пиксел не зависит от w_size. Изображение обрабатывается горизонтальными
+    полосами по strip_rows строк, и бинаризованная полоса сразу записывается в изображение (uint8): вещественные
+    массивы существуют только для одной полосы, копия всей страницы не создается
+    """
+
+    @staticmethod
+    def threshold_values(mean: np.ndarray, std: Optional[np.ndarray], method: ThresholdMethod, k: float,
+                         r: float = 128., min_value: float = 0.) -> np.ndarray:
+        # пороги по средним и стандартным отклонениям в окнах; r -- динамический диапазон стандартного отклонения
+        # (для Вольфа -- максимальное отклонение по изображению), min_value -- минимальная яркость изображения
+        if method == BRADLEY_THRESHOLD:
+            return mean * (1 - k)
+        elif method == NIBLACK_THRESHOLD:
+            return mean + k * std
+        elif method == SAUVOLA_THRESHOLD:
+            return mean * (1 + k * (std / r - 1))
+        elif method == WOLF_THRESHOLD:
+            return (1 - k) * mean + k * min_value + k * (std / r) * (mean - min_value)
+        raise ValueError("Неизвестный метод бинаризации: %s" % method)
+
+    @staticmethod
+    def _window_stats(block: np.ndarray, b0: int, top: int, bot: int, h: int, w_size: int, need_std: bool) \
+            -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        # средние и стандартные отклонения яркости в окнах пикселов строк [top, bot) изображения высоты h;
+        # block -- исходные строки [b0, b1) изображения, где b0 = max(0, top - w_size // 2),
+        # b1 = min(bot + w_size // 2, h)
+        w = block.shape[1]
+        hw_size = w_size // 2
+        x = np.arange(1, w + 1)
+        x1, x2 = (x - hw_size).clip(1, w), (x + hw_size).clip(1, w)
+        block = block.astype(np.int64)
+
+        # таблицы сумм по блоку: разности их строк совпадают с разностями таблицы всей страницы
+        integral = np.zeros((block.shape[0] + 1, w + 1), dtype=np.int64)
+        np.cumsum(np.cumsum(block, axis=0), axis=1, out=integral[1:, 1:])
+
+        y = np.arange(top + 1, bot + 1)
+        y1, y2 = (y - hw_size).clip(1, h) - 1 - b0, (y + hw_size).clip(1, h) - b0
+        sizes = np.outer(y2 - y1, (x2 - x1 + 1).astype(np.float64))
+
+        def window_sums(table: np.ndarray) -> np.ndarray:
+            return table[np.ix_(y2, x2)] - table[np.ix_(y2, x1 - 1)] - \
+                table[np.ix_(y1, x2)] + table[np.ix_(y1, x1 - 1)]
+
+        mean = window_sums(integral) / sizes
+        if not need_std:
+            return mean, None
+
+        integral_sq = integral  # таблица сумм I больше не нужна
+        np.cumsum(np.cumsum(block * block, axis=0), axis=1, out=integral_sq[1:, 1:])
+        return mean, np.sqrt(np.maximum(window_sums(integral_sq) / sizes - mean * mean, 0))
+
+    @staticmethod
+    def _pixel_stats(block: np.ndarray, b0: int, h: int, w_size: int, ys: np.ndarray, xs: np.ndarray,
+                     need_std: bool) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        # то же, что _window_stats, но только для пикселов (ys, xs) изображения высоты h; block -- исходные строки
+        # [b0, b1) изображения, покрывающие окна этих пикселов. Таблицы сумм строятся только по столбцам, которые
+        # задевают окна, и хранят точные целые суммы (в float64), поэтому результат совпадает с _window_stats
+        w = block.shape[1]
+        hw_size = w_size // 2
+        c0, c1 = max(0, int(xs.min()) - hw_size), min(int(xs.max()) + hw_size + 1, w)
+        integral, integral_sq = cv2.integral2(np.ascontiguousarray(block[:, c0: c1]), sdepth=cv2.CV_64F,
+                                              sqdepth=cv2.CV_64F)
+
+        x1, x2 = (xs + 1 - hw_size).clip(1, w), (xs + 1 + hw_size).clip(1, w)
+        y1, y2 = (ys + 1 - hw_size).clip(1, h) - 1 - b0, (ys + 1 + hw_size).clip(1, h) - b0
+        sizes = ((y2 - y1) * (x2 - x1 + 1)).astype(np.float64)
+        x1, x2 = x1 - 1 - c0, x2 - c0
+
+        def window_sums(table: np.ndarray) -> np.ndarray:
+            return table[y2, x2] - table[y2, x1] - table[y1, x2] + table[y1, x1]
+
+        mean = window_sums(integral) / sizes
+        if not need_std:
+            return mean, None
+        return mean, np.sqrt(np.maximum(window_sums(integral_sq) / sizes - mean * mean, 0))
+
+    @staticmethod
+    def _strips(img: np.ndarray, w_size: int, need_std: bool, strip_rows: int) \
+            -> Iterator[Tuple[int, int, np.ndarray, Optional[np.ndarray]]]:
+        # для каждой полосы строк [top, bot) -- средние и стандартные отклонения яркости в окнах ее пикселов.
+        # Перед тем как перейти к следующей полосе, вызывающий код может перезаписать строки [top, bot)
+        # изображения: строки над полосой, нужные для ее окон, сохраняются заранее
+        h = img.shape[0]
+        hw_size = w_size // 2
+
+        saved = img[0: 0].copy()  # исходные строки [max(0, top - hw_size), top)
+        for top in range(0, h, strip_rows):
+            bot = min(top + strip_rows, h)
+            b0, b1 = max(0, top - hw_size), min(bot + hw_size, h)
+            block = np.concatenate([saved, img[top: b1]])
+            mean, std = LocalThreshold._window_stats(block, b0, top, bot, h, w_size, need_std)
+
+            # исходные строки, нужные окнам следующей полосы сверху, берутся из блока до возможной перезаписи
+            saved = block[max(0, bot - hw_size) - b0: bot - b0].copy()
+            yield top, bot, mean, std
+
+    @staticmethod
+    def _global_stats(img: np.ndarray, method: ThresholdMethod, w_size: int, r: float, strip_rows: int) \
+            -> Tuple[float, float]:
+        # (r, min_value) для threshold_values: Вольфу нужны глобальные минимум яркости и максимум отклонения --
+        # для них делается отдельный проход без записи
+        if method != WOLF_THRESHOLD:
+            return r, 0.
+        r = max((float(std.max()) for _, _, _, std in LocalThreshold._strips(img, w_size, True, strip_rows)),
+                default=0.)
+        return r or 1., float(img.min())
+
+    @staticmethod
+    def apply(img: np.ndarray, method: ThresholdMethod = BRADLEY_THRESHOLD, w_size: int = 15,
+              k: Optional[float] = None, r: float = 128., strip_rows: int = 256, wp_val: int = 255) -> np.ndarray:
+        """
+        Бинаризует img на месте: пикселы не темнее порога становятся wp_val, остальные -- 0 (как apply_threshold
+        из pythreshold)
+
+        :param img: изображение в оттенках серого (uint8)
+        :param method: BRADLEY_THRESHOLD, NIBLACK_THRESHOLD, SAUVOLA_THRESHOLD или WOLF_THRESHOLD
+        :param w_size: размер окна
+        :param k: параметр метода (для Брэдли-Рота -- w); по умолчанию -- DEFAULT_K[method]
+        :param r: динамический диапазон стандартного отклонения для Сауволы
+        :param strip_rows: количество строк в обрабатываемой за раз полосе
+        :param wp_val: значение пикселов фона
+        :return: img
+        """
+
+        if k is None:
+            k = DEFAULT_K[method]
+        need_std = method != BRADLEY_THRESHOLD
+        r, min_value = LocalThreshold._global_stats(img, method, w_size, r, strip_rows)
+
+        for top, bot, mean, std in LocalThreshold._strips(img, w_size, need_std, strip_rows):
+            thresholds = LocalThreshold.threshold_values(mean, std, method, k, r, min_value)
+            strip = img[top: bot]
+            np.multiply(strip >= thresholds, wp_val, out=strip, casting='unsafe')
+
+        return img
+
+    @staticmethod
+    def apply_pyramid(img: np.ndarray, method: ThresholdMethod = BRADLEY_THRESHOLD, w_size: int = 15,
+                      k: Optional[float] = None, r: float = 128., level: int = 1, tolerance: float = 0.,
+                      strip_rows: int = 256, wp_val: int = 255, verify: bool = False) -> PyramidReport:
+        """
+        Бинаризует img на месте, как apply, но пороги считаются на уменьшенном в 2 ** level раз изображении
+        (окно уменьшается во столько же раз) и билинейно растягиваются до исходного размера. Пикселы, яркость
+        которых отличается от приближенного порога не больше чем на tolerance, пересчитываются по точному порогу:
+        суммы по окнам считаются только для них. Глобальные минимум яркости и максимум отклонения (для Вольфа)
+        берутся с уменьшенного изображения, поэтому у Вольфа и пересчитанные пороги приближенные
+
+        :param img: изображение в оттенках серого (uint8)
+        :param level: уровень пирамиды: 1 -- 1/2, 2 -- 1/4 и т.д.
+        :param tolerance: ширина полосы неуверенности вокруг приближенного порога (в единицах яркости)
+        :param verify: посчитать также точный результат apply и количество пикселов, которые от него отличаются
+        :return: отчет о пересчитанных и отличающихся пикселах
+        """
+
+        if k is None:
+            k = DEFAULT_K[method]
+        need_std = method != BRADLEY_THRESHOLD
+        h, w = img.shape
+        scale = 2 ** level
+        report = PyramidReport(scale)
+
+        exact = LocalThreshold.apply(img.copy(), method, w_size, k, r, strip_rows, wp_val) if verify else None
+
+        # поверхность порогов на уменьшенном изображении
+        small = cv2.resize(img, (max(1, -(-w // scale)), max(1, -(-h // scale))), interpolation=cv2.INTER_AREA)
+        small_w_size = max(1, int(round(w_size / scale)))
+        small_r, small_min = LocalThreshold._global_stats(small, method, small_w_size, r, strip_rows)
+        surface = np.empty(small.shape, dtype=np.float32)
+        for top, bot, mean, std in LocalThreshold._strips(small, small_w_size, need_std, strip_rows):
+            surface[top: bot] = LocalThreshold.threshold_values(mean, std, method, k, small_r, small_min)
+        surface = cv2.resize(surface, (w, h), interpolation=cv2.INTER_LINEAR)
+
+        # пикселы полосы неуверенности пересчитываются по точным порогам: суммы по окнам берутся только для них.
+        # Глобальные минимум яркости и максимум отклонения для Вольфа -- с уменьшенного изображения
+        hw_size = w_size // 2
+        for top in range(0, h, strip_rows):
+            bot = min(top + strip_rows, h)
+            rows, thresholds = img[top: bot], surface[top: bot]
+            ys, xs = np.nonzero(np.abs(rows - thresholds) <= tolerance)
+            if len(ys):
+                b0, b1 = max(0, top - hw_size), min(bot + hw_size, h)
+                mean, std = LocalThreshold._pixel_stats(img[b0: b1], b0, h, w_size, ys + top, xs, need_std)
+                exact_thresholds = LocalThreshold.threshold_values(mean, std, method, k, small_r, small_min)
+                values, approx = rows[ys, xs], thresholds[ys, xs]
+                report.recomputed += len(ys)
+                report.flipped += int(((values >= approx) != (values >= exact_thresholds)).sum())
+                # в surface (float32) записывается не точный порог, а уже принятое по нему решение: -1 -- фон, 256 --
+                # закрашенный пиксел, иначе округление порога до float32 могло бы изменить результат сравнения
+                thresholds[ys, xs] = np.where(values >= exact_thresholds, -1, 256)
+
+        # исходные строки больше не нужны: вся страница бинаризуется одним сравнением
+        np.multiply(img >= surface, wp_val, out=img, casting='unsafe')
+
+        if verify:
+            report.differing = int((img != exact).sum())
+        return report
+
+
+class PyramidReport:
+    # результат LocalThreshold.apply_pyramid
+    scale: int  # во сколько раз было уменьшено изображение
+    recomputed: int  # сколько пикселов попали в полосу неуверенности и были пересчитаны по точным порогам
+    flipped: int  # у скольких из них точный порог изменил результат
+    differing: Optional[int]  # сколько пикселов отличаются от точного результата (только при verify=True)
+
+    def __init__(self, scale: int):
+        self.scale = scale
+        self.recomputed = 0
+        self.flipped = 0
+        self.differing = None
+
+    def __str__(self) -> str:
+        return "scale: 1/%d; recomputed: %d; flipped: %d; differing: %s" % \
+               (self.scale, self.recomputed, self.flipped, self.differing)
@@ -0,0 +1,162 @@
+from __future__ import annotations
+from typing import *
+from collections import OrderedDict
+import hashlib
+import os
+import numpy as np
+from image_preprocessing.PicHandler import PicHandler
+from image_preprocessing.Pipeline import Pipeline
+from utils.BitPage import BitPage
+
+HASH_CHUNK = 1 << 20  # файл хешируется кусками такого размера
+
+
+class PageCache:
+    """
+    Кеш прочитанных и предобработанных страниц. Ключ -- хеш содержимого файла (или путь, время изменения и размер
+    файла при by_content=False), сигнатура конвейера предобработки (см. Pipeline.signature) и масштаб чтения.
+    В памяти страницы хранятся в LRU, ограниченном max_bytes байт; если задан cache_dir, бинарные страницы
+    (только 0 и 255) дополнительно сохраняются на диск упакованными по 8 пикселов в байт и сжатыми.
+    Страницы возвращаются без копирования, только для чтения: PicHandler скопирует страницу перед первым изменением
+    на месте
+    """
+
+    max_bytes: int
+    cache_dir: Optional[str]
+    by_content: bool
+    stats: CacheStats
+    _pages: OrderedDict  # ключ -> (изображение, масштаб); в конце -- последние использованные
+    _bytes: int  # суммарный размер страниц в памяти
+
+    def __init__(self, max_bytes: int = 256 << 20, cache_dir: Optional[str] = None, by_content: bool = True):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.by_content = by_content
+        self.stats = CacheStats()
+        self._pages = OrderedDict()
+        self._bytes = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def file_key(self, path: str) -> str:
+        st = os.stat(path)
+        if not self.by_content:
+            return '%s:%d:%d' % (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def key(self, path: str, pipeline: Optional[Pipeline] = None, scale: float = 1.) -> str:
+        signature = pipeline.signature() if pipeline is not None else ''
+        return hashlib.sha1(('%s|%r|%s' % (self.file_key(path), scale, signature)).encode()).hexdigest()
+
+    def get(self, path: str, pipeline: Optional[Pipeline] = None, scale: float = 1.) -> PicHandler:
+        """
+        Страница из кеша; при промахе -- PicHandler(path, scale=scale), обработанная pipeline
+
+        :param path: путь к файлу с изображением
+        :param pipeline: предобработка страницы; None -- без предобработки
+        :param scale: масштаб чтения (см. PicHandler)
+        :return: PicHandler со страницей только для чтения
+        """
+
+        key = self.key(path, pipeline, scale)
+        if key in self._pages:
+            self.stats.hits += 1
+            self._pages.move_to_end(key)
+            img, page_scale = self._pages[key]
+            return PageCache._handler(img, page_scale)
+
+        loaded = self._load(key)
+        if loaded is not None:
+            self.stats.disk_hits += 1
+            img, page_scale = loaded
+        else:
+            self.stats.misses += 1
+            ph = PicHandler(path, scale=scale)
+            if pipeline is not None:
+                ph.exec_pipeline(pipeline)
+            img, page_scale = ph.img, ph.scale
+            self._save(key, img, page_scale)
+
+        img.flags.writeable = False
+        self._remember(key, img, page_scale)
+        return PageCache._handler(img, page_scale)
+
+    @staticmethod
+    def _handler(img: np.ndarray, scale: float) -> PicHandler:
+        ph = PicHandler(img, make_copy=False, is_colored=False)
+        ph.scale = scale
+        return ph
+
+    def clear(self) -> None:
+        # очищает кеш в памяти (файлы на диске остаются)
+        self._pages.clear()
+        self._bytes = 0
+
+    def _remember(self, key: str, img: np.ndarray, scale: float) -> None:
+        if img.nbytes > self.max_bytes:
+            return
+        self._pages[key] = (img, scale)
+        self._bytes += img.nbytes
+        while self._bytes > self.max_bytes:
+            _, (old, _) = self._pages.popitem(last=False)
+            self._bytes -= old.nbytes
+            self.stats.evictions += 1
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def _save(self, key: str, img: np.ndarray, scale: float) -> None:
+        # на диск сохраняются только бинарные страницы: 1 бит на пиксел (закрашенный -- 0 на странице)
+        if self.cache_dir is None or img.dtype != np.uint8 or img.ndim != 2 or \
+                not np.all((img == 0) | (img == 255)):
+            return
+        bits = BitPage.from_dense(img == 0)
+        tmp = self._disk_path(key) + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, bits=bits.bits, shape=np.array(bits.shape), scale=np.array(scale))
+        os.replace(tmp, self._disk_path(key))
+
+    def _load(self, key: str) -> Optional[Tuple[np.ndarray, float]]:
+        if self.cache_dir is None or not os.path.exists(self._disk_path(key)):
+            return None
+        with np.load(self._disk_path(key)) as data:
+            bits = BitPage(tuple(data['shape'].tolist()), data['bits'])
+            scale = float(data['scale'])
+        img = bits.to_dense()
+        np.subtract(1, img, out=img)  # 1 -- закрашенный пиксел -> 0, иначе 1
+        img *= 255
+        return img, scale
+
+
+class CacheStats:
+    # статистика PageCache
+    hits: int  # страница найдена в памяти
+    disk_hits: int  # страница прочитана с диска
+    misses: int  # страница прочитана из исходного файла и обработана
+    evictions: int  # страницы, вытесненные из памяти
+
+    def __init__(self):
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.disk_hits + self.misses
+        return (self.hits + self.disk_hits) / total if total else 0.
+
+    def __str__(self) -> str:
+        return "hits: %d; disk hits: %d; misses: %d; evictions: %d; hit rate: %.2f" % \
+               (self.hits, self.disk_hits, self.misses, self.evictions, self.hit_rate())
@@ -4,13 +4,22 @@ import cv2
 import numpy as np
 from pythreshold.utils import *
 from utils.geometry import Rect
-from skimage.transform import resize, rescale
+from utils.algs import build_integral
+from utils.RLEPage import RLEPage
+from utils.BitPage import BitPage
+from image_preprocessing.LocalThreshold import LocalThreshold, PyramidReport, ThresholdMethod, BRADLEY_THRESHOLD
 
 
 FilterTypes = int
 GAUSSIAN_FILTER = 0
 MEDIAN_FILTER = 1
 
+# флаги cv2.imread для чтения с уменьшением в 1, 2, 4, 8 раз (JPEG уменьшается прямо при декодировании)
+_IMREAD_GRAYSCALE = {1: cv2.IMREAD_GRAYSCALE, 2: cv2.IMREAD_REDUCED_GRAYSCALE_2, 4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+                     8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+_IMREAD_COLOR = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4,
+                 8: cv2.IMREAD_REDUCED_COLOR_8}
+
 StackingType = int
 HORIZONTAL = 0
 VERTICAL = 1
@@ -42,11 +51,17 @@ def view_images(images: Iterable[np.ndarray], name_of_window: str = 'Images', st
 
 class PicHandler:
     img: np.ndarray  # объект изображения в BGR
+    scale: float  # масштаб img относительно файла, из которого изображение было прочитано
 
-    def __init__(self, image: Union[str, np.ndarray], make_copy: bool = True, is_colored: bool = True):
+    def __init__(self, image: Union[str, np.ndarray], make_copy: bool = True, is_colored: bool = True,
+                 scale: float = 1.):
         # image -- путь к файлу с изображением или np.ndarray -- представление изображения BGR в виде массива;
         # если передан массив, то make_copy: bool -- необходимо ли работать с копией переданного массива;
         # если передан путь к файлу, то изображение открывается, и при is_colored = True делается черно-белым
+        # (при уменьшенном декодировании JPEG -- сразу, без промежуточного BGR); scale -- масштаб, до которого страница
+        # все равно будет уменьшена: если scale <= 1/2, декодер сразу уменьшает ее в 2, 4 или 8 раз (но не сильнее,
+        # чем до scale)
+        self.scale = 1.
 
         if isinstance(image, np.ndarray):
             if make_copy:
@@ -56,17 +71,66 @@ class PicHandler:
             if is_colored:
                 self.img = self.make_black_and_white(self.img)
 
+        elif isinstance(image, type('')) and image.endswith('.npy'):
+            # заранее декодированная страница: отображается в память без копирования (см. from_mmap)
+            self.img = np.load(image, mmap_mode='r')
+            if is_colored and self.img.ndim == 3:
+                self.img = self.make_black_and_white(self.img)
+
         elif isinstance(image, type('')):
-            t = cv2.imread(image)
+            factor = max(f for f in (1, 2, 4, 8) if f * scale <= 1 or f == 1)
+            # в оттенки серого сразу декодируется только уменьшенный JPEG: декодер берет яркость прямо из YCbCr, и она
+            # отличается от cvtColor(BGR) на несколько уровней серого (до 6-7), что меняет результат сегментации;
+            # при scale = 1 страница декодируется в BGR и переводится в оттенки серого, как раньше. Остальные форматы
+            # декодер переводит в оттенки серого иначе (например, PNG с альфа-каналом)
+            to_gray = is_colored and factor > 1 and PicHandler._is_jpeg(image)
+            t = cv2.imread(image, (_IMREAD_GRAYSCALE if to_gray else _IMREAD_COLOR)[factor])
 
             if isinstance(t, type(None)):
                 # изображение не удалось загрузить
                 raise Exception("Некорректный путь к изображению")
 
-            if is_colored:
+            if is_colored and not to_gray:
                 t = self.make_black_and_white(t)
 
             self.img = t
+            self.scale = 1 / factor
+
+    @staticmethod
+    def from_mmap(path: str, shape: Optional[Tuple[int, int]] = None, dtype: type = np.uint8,
+                  offset: int = 0) -> PicHandler:
+        """
+        PicHandler над страницей, отображенной в память из файла только для чтения, без копирования: операции,
+        которые только читают изображение, работают прямо с отображением, а перед первым изменением на месте
+        страница копируется в память (см. _ensure_writable)
+
+        :param path: файл .npy или файл с матрицей страницы без заголовка (построчно)
+        :param shape: (h, w) страницы для файла без заголовка; для .npy берется из заголовка
+        :param dtype: тип элементов матрицы для файла без заголовка
+        :param offset: смещение матрицы от начала файла без заголовка, байт
+        """
+
+        if path.endswith('.npy'):
+            img = np.load(path, mmap_mode='r')
+        elif shape is None:
+            raise ValueError("Для файла без заголовка нужно указать размер страницы")
+        else:
+            img = np.memmap(path, dtype=dtype, mode='r', shape=(int(shape[0]), int(shape[1])), offset=offset)
+        return PicHandler(img, make_copy=False, is_colored=False)
+
+    def _ensure_writable(self) -> None:
+        # копирование при записи: страница только для чтения (например, отображенная из файла) копируется в память
+        # перед первым изменением на месте
+        if not self.img.flags.writeable:
+            self.img = np.array(self.img)
+
+    @staticmethod
+    def _is_jpeg(path: str) -> bool:
+        try:
+            with open(path, 'rb') as f:
+                return f.read(3) == b'\xff\xd8\xff'
+        except OSError:
+            return False
 
     def get_image(self) -> np.ndarray:
         return self.img
@@ -93,16 +157,73 @@ class PicHandler:
     def apply_global_bin_filter(self, thresh: int = 220) -> None:
         # во все пикселы, значения которых больше порога thresh, устанавливаются значения 255
         # во все остальные -- 0
+        self._ensure_writable()
+        if self.img.dtype == np.uint8:
+            PicHandler.rebin(self.img, thresh)
+            return
         mask = self.img >= thresh
         self.img[mask] = 255
         self.img[~mask] = 0
 
+    @staticmethod
+    def rebin(img: np.ndarray, thresh: int = 220) -> np.ndarray:
+        # бинаризация uint8 на месте, как apply_global_bin_filter: img >= thresh -> 255, иначе 0
+        cv2.threshold(img, thresh - 1, 255, cv2.THRESH_BINARY, dst=img)
+        return img
+
     def apply_adaptive_bin_filter(self, mode: int = 0, **params):
         if mode == 0:
             self.img = apply_threshold(self.img, bradley_roth_threshold(self.img, **params))
         else:
             self.img = apply_threshold(self.img, singh_threshold(self.img))
 
+    def apply_local_bin_filter(self, method: ThresholdMethod = BRADLEY_THRESHOLD, w_size: int = 15,
+                               k: Optional[float] = None, **params) -> None:
+        # бинаризует self.img на месте одним из локальных методов LocalThreshold (Брэдли-Рот, Ниблэк, Саувола,
+        # Вольф); params -- прочие параметры LocalThreshold.apply
+        self._ensure_writable()
+        LocalThreshold.apply(self.img, method, w_size, k, **params)
+
+    def apply_pyramid_bin_filter(self, method: ThresholdMethod = BRADLEY_THRESHOLD, w_size: int = 15,
+                                 k: Optional[float] = None, level: int = 1, tolerance: float = 0.,
+                                 **params) -> PyramidReport:
+        # то же, что apply_local_bin_filter, но поверхность порогов считается на уровне level пирамиды (1/2, 1/4, ...)
+        # и растягивается до исходного размера; см. LocalThreshold.apply_pyramid
+        self._ensure_writable()
+        return LocalThreshold.apply_pyramid(self.img, method, w_size, k, level=level, tolerance=tolerance, **params)
+
+    @staticmethod
+    def local_means(integral: np.ndarray, w_size: int) -> np.ndarray:
+        # средние по окнам w_size x w_size с центрами в пикселах (окна обрезаются краями изображения) -- так же, как
+        # в bradley_roth_threshold из pythreshold
+        rows, cols = integral.shape[0] - 1, integral.shape[1] - 1
+        hw_size = w_size // 2
+        x, y = np.arange(1, cols + 1), np.arange(1, rows + 1)
+        x1, x2 = (x - hw_size).clip(1, cols), (x + hw_size).clip(1, cols)
+        y1, y2 = (y - hw_size).clip(1, rows), (y + hw_size).clip(1, rows)
+
+        sums = integral[np.ix_(y2, x2)] - integral[np.ix_(y2, x1 - 1)] - \
+            integral[np.ix_(y1 - 1, x2)] + integral[np.ix_(y1 - 1, x1 - 1)]
+        return sums / np.outer(y2 - y1 + 1, x2 - x1 + 1)
+
+    def sweep_adaptive_bin_filter(self, settings: Iterable[Tuple[float, int]]) \
+            -> Iterator[Tuple[float, int, np.ndarray]]:
+        """
+        Перебор параметров бинаризации Брэдли-Рота (apply_adaptive_bin_filter(mode=0, w=..., w_size=...)) без
+        изменения self.img: таблица сумм строится один раз, средние по окнам -- один раз для каждого w_size
+
+        :param settings: пары (w, w_size)
+        :return: для каждой пары -- (w, w_size, бинаризованное изображение), совпадающее с результатом
+        apply_adaptive_bin_filter с этими параметрами
+        """
+
+        integral = build_integral(self.img)
+        means: Dict[int, np.ndarray] = {}
+        for w, w_size in settings:
+            if w_size not in means:
+                means[w_size] = PicHandler.local_means(integral, w_size)
+            yield w, w_size, apply_threshold(self.img, means[w_size] * (1 - w))
+
     def get_copy(self) -> np.ndarray:
         return self.img.copy()
 
@@ -111,23 +232,30 @@ class PicHandler:
         view_image(self.img, 'pic_handler_image')
 
     @staticmethod
-    def crop(img: np.ndarray, rect: Rect, make_copy: bool = False) -> np.ndarray:
+    def crop(img: Union[np.ndarray, RLEPage, BitPage], rect: Rect, make_copy: bool = False) \
+            -> Union[np.ndarray, BitPage]:
+        # для RLEPage фрагмент всегда возвращается новой плотной матрицей, для BitPage -- новым упакованным фрагментом
+        # (см. TextBlock.contents)
         min_x, max_x = rect.left(), rect.right()
         min_y, max_y = rect.top(), rect.bottom()
 
         res = img[min_y: max_y + 1, min_x: max_x + 1]
+        if isinstance(res, RLEPage):
+            return res.to_dense()
+        if isinstance(res, BitPage):
+            return res
         return res.copy() if make_copy else res
 
     @staticmethod
-    def draw_pixels(rect: Rect, pixels: Set[Tuple[int, int]]) -> np.ndarray:
-        # имеем pixels -- координаты закрашенных "1" точек на исходном изображении.
-        # Метод рисует то, что должно быть в rect
+    def draw_pixels(rect: Rect, pixels: Union[Set[Tuple[int, int]], np.ndarray]) -> np.ndarray:
+        # имеем pixels -- координаты закрашенных "1" точек (x, y) на исходном изображении: множество кортежей или
+        # массив (k, 2) (см. ComponentStore.pixels). Метод рисует то, что должно быть в rect
         sh = rect.shape()
-        dy, dx = -rect.top(), -rect.left()
         res = np.zeros((sh[1] + 1, sh[0] + 1), dtype=np.uint8)
-        for x, y in pixels:
-            res[y + dy, x + dx] = 1
+        if not isinstance(pixels, np.ndarray):
+            pixels = np.array(list(pixels), dtype=np.intp).reshape((-1, 2))
 
+        res[pixels[:, 1] - rect.top(), pixels[:, 0] - rect.left()] = 1
         return res
 
     def make_zero_one(self) -> np.ndarray:
@@ -135,12 +263,23 @@ class PicHandler:
         # Не вызывайте этот метод, если изображение не бинаризовано
         return (self.img == 0).astype(np.uint8)
 
+    def to_rle(self) -> RLEPage:
+        # бинарное изображение в формате RLEPage: сериями кодируются закрашенные (черные) пикселы, как в make_zero_one.
+        # Не вызывайте этот метод, если изображение не бинаризовано
+        return RLEPage.from_dense(self.img == 0)
+
+    def to_bits(self) -> BitPage:
+        # бинарное изображение, упакованное по 8 пикселов в байт: единичные биты -- закрашенные (черные) пикселы,
+        # как в make_zero_one. Не вызывайте этот метод, если изображение не бинаризовано
+        return BitPage.from_dense(self.img == 0)
+
     @staticmethod
     def from_zero_one(mat: np.ndarray) -> np.ndarray:
         # mat: 1, если пиксел не закрашен, иначе 0
         return mat * 255
 
     def draw_rect(self, rect: Rect, color: int = 0) -> None:
+        self._ensure_writable()
         left, right, top, bottom = rect.left(), rect.right(), rect.top(), rect.bottom()
         for x_static in (left, right):
             for y_dyn in range(top, bottom + 1):
@@ -150,20 +289,68 @@ class PicHandler:
             for x_dyn in range(left, right + 1):
                 self.img[y_static, x_dyn] = color
 
-    def __rebin(self) -> None:
-        self.apply_global_bin_filter()
-
-    def resize(self, shape: Tuple[int, int]) -> None:
-        self.img = resize(self.img, shape, preserve_range=True)
-        self.__rebin()
-
-    def rescale(self, scale: float) -> None:
-        self.img = rescale(self.img, scale)
-        self.__rebin()
-
-    def exec_pipeline(self, pipeline: Callable, make_copy: bool=False, **params) -> PicHandler:
-        pipeline(self, **params)
-        return self
+    @staticmethod
+    def resize_image(img: np.ndarray, shape: Tuple[int, int], dst: Optional[np.ndarray] = None,
+                     is_binary: bool = False, rebin_thresh: Optional[int] = None) -> np.ndarray:
+        """
+        Изменение размера изображения uint8 без перехода к вещественным числам
+
+        :param img: изображение uint8
+        :param shape: новый размер (h, w)
+        :param dst: заранее выделенный массив uint8 формы shape для результата; по умолчанию -- новый массив
+        :param is_binary: img бинарное (0 и 255): используется ближайший сосед, новых оттенков не появляется;
+        иначе при уменьшении -- усреднение по площади, при увеличении -- билинейная интерполяция
+        :param rebin_thresh: если задан, результат сразу бинаризуется на месте (см. rebin)
+        :return: dst
+        """
+
+        h, w = int(shape[0]), int(shape[1])
+        if dst is None:
+            dst = np.empty((h, w), dtype=np.uint8)
+
+        if is_binary:
+            interpolation = cv2.INTER_NEAREST
+        elif h * w < img.shape[0] * img.shape[1]:
+            interpolation = cv2.INTER_AREA
+        else:
+            interpolation = cv2.INTER_LINEAR
+
+        cv2.resize(img, (w, h), dst=dst, interpolation=interpolation)
+        if rebin_thresh is not None:
+            PicHandler.rebin(dst, rebin_thresh)
+        return dst
+
+    def resize(self, shape: Tuple[int, int], dst: Optional[np.ndarray] = None, is_binary: bool = False) -> None:
+        # изменяет размер изображения (shape = (h, w)) и снова бинаризует его (порог 220)
+        self.img = PicHandler.resize_image(self.img, shape, dst, is_binary, rebin_thresh=220)
+
+    def rescale(self, scale: float, dst: Optional[np.ndarray] = None, is_binary: bool = False) -> None:
+        # то же, что resize, но новый размер задается коэффициентом
+        h, w = self.img.shape[:2]
+        self.resize((max(1, int(round(h * scale))), max(1, int(round(w * scale)))), dst, is_binary)
+
+    def exec_pipeline(self, pipeline: Union[Callable, Pipeline], make_copy: bool = False,
+                      memory_budget: Optional[int] = None, **params) -> PicHandler:
+        # выполняет pipeline -- функцию pipeline(ph, **params) или Pipeline (см. image_preprocessing.Pipeline);
+        # при make_copy = True self не изменяется, а возвращается новый PicHandler с результатом.
+        # Если задан memory_budget (байт), Pipeline выполняется по фрагментам страницы (см. Pipeline.run_tiled)
+        from image_preprocessing.Pipeline import Pipeline
+
+        res = PicHandler(self.img, make_copy=False, is_colored=False) if make_copy else self
+        res.scale = self.scale
+        # страница только для чтения не изменяется на месте, даже если make_copy = False (см. _ensure_writable)
+        in_place = not make_copy and self.img.flags.writeable
+        if isinstance(pipeline, Pipeline) and memory_budget is not None:
+            out = self.img if in_place else np.empty_like(self.img)
+            res.img = pipeline.run_tiled(self.img, out, memory_budget)
+        elif isinstance(pipeline, Pipeline):
+            # копия не нужна: при make_copy конвейер сам не изменяет исходное изображение
+            res.img = pipeline.run(self.img, in_place=in_place, detach=True)
+        else:
+            if make_copy:
+                res.img = self.img.copy()
+            pipeline(res, **params)
+        return res
 
 
 if __name__ == '__main__':
@@ -198,12 +385,9 @@ if __name__ == '__main__':
 
     def test_bin_advanced(fname):
         p1_photo = PicHandler(fname)
-        p1_low, p1_high = PicHandler(fname), PicHandler(fname)
-        p1_low.apply_adaptive_bin_filter(w=0.05, w_size=25)
-        p1_photo.apply_adaptive_bin_filter(w=0.1, w_size=25)
-        p1_high.apply_adaptive_bin_filter(w=0.15, w_size=25)
+        sweep = p1_photo.sweep_adaptive_bin_filter([(0.05, 25), (0.1, 25), (0.15, 25)])
 
-        view_images([p1_low.img, p1_photo.img, p1_high.img])
+        view_images([img for w, w_size, img in sweep])
 
 
     def test_filter_bin(fname, **params):
@@ -0,0 +1,248 @@
+from __future__ import annotations
+from typing import *
+import inspect
+import time
+import cv2
+import numpy as np
+from pythreshold.utils import *
+from image_preprocessing.PicHandler import PicHandler, GAUSSIAN_FILTER, MEDIAN_FILTER
+from image_preprocessing.LocalThreshold import LocalThreshold, ThresholdMethod, BRADLEY_THRESHOLD, WOLF_THRESHOLD
+from utils.tiling import Tile, DEFAULT_MEMORY_BUDGET, tile_side, split_into_tiles
+
+
+class _Stage:
+    # операция конвейера: run(src, dst) пишет результат в dst (для операций на месте dst is src)
+    name: str
+    params: Dict[str, Any]
+    in_place: bool  # операция может выполняться на месте
+    run: Callable[[np.ndarray, np.ndarray], None]
+    out_shape: Callable[[Tuple[int, int]], Tuple[int, int]]
+    radius: Optional[int]  # результат в пикселе зависит только от пикселов не дальше radius; None -- от всей
+    # страницы или операция меняет размер
+
+    def __init__(self, name: str, params: Dict[str, Any], in_place: bool,
+                 run: Callable[[np.ndarray, np.ndarray], None],
+                 out_shape: Callable[[Tuple[int, int]], Tuple[int, int]] = lambda shape: shape,
+                 radius: Optional[int] = None):
+        self.name, self.params, self.in_place, self.run, self.out_shape = name, params, in_place, run, out_shape
+        self.radius = radius
+
+
+class _Operations:
+    # операции PicHandler, доступные в Pipeline: каждая проверяет параметры и возвращает _Stage
+
+    @staticmethod
+    def resize(shape: Tuple[int, int], is_binary: bool = False) -> _Stage:
+        shape = int(shape[0]), int(shape[1])
+        if min(shape) <= 0:
+            raise ValueError("Некорректный размер изображения: %s" % (shape,))
+        return _Stage('resize', {'shape': shape, 'is_binary': is_binary}, False,
+                      lambda src, dst: PicHandler.resize_image(src, shape, dst, is_binary, rebin_thresh=220),
+                      lambda _: shape)
+
+    @staticmethod
+    def rescale(scale: float, is_binary: bool = False) -> _Stage:
+        if scale <= 0:
+            raise ValueError("Некорректный коэффициент масштабирования: %s" % scale)
+
+        def out_shape(shape: Tuple[int, int]) -> Tuple[int, int]:
+            # как в PicHandler.rescale
+            return max(1, int(round(shape[0] * scale))), max(1, int(round(shape[1] * scale)))
+
+        return _Stage('rescale', {'scale': scale, 'is_binary': is_binary}, False,
+                      lambda src, dst: PicHandler.resize_image(src, dst.shape, dst, is_binary, rebin_thresh=220),
+                      out_shape)
+
+    @staticmethod
+    def apply_filter(filter_type: int, filter_size: int = 9) -> _Stage:
+        if filter_size <= 0 or filter_size % 2 == 0:
+            raise ValueError("Размер фильтра должен быть нечетным положительным числом: %s" % filter_size)
+
+        if filter_type == GAUSSIAN_FILTER:
+            run = lambda src, dst: cv2.GaussianBlur(src, (filter_size, filter_size), 0, dst=dst)
+        elif filter_type == MEDIAN_FILTER:
+            run = lambda src, dst: cv2.medianBlur(src, filter_size, dst=dst)
+        else:
+            raise ValueError("Неизвестный фильтр: %s" % filter_type)
+        return _Stage('apply_filter', {'filter_type': filter_type, 'filter_size': filter_size}, False, run,
+                      radius=filter_size // 2)
+
+    @staticmethod
+    def apply_global_bin_filter(thresh: int = 220) -> _Stage:
+        return _Stage('apply_global_bin_filter', {'thresh': thresh}, True,
+                      lambda src, dst: PicHandler.rebin(src, thresh), radius=0)
+
+    @staticmethod
+    def apply_adaptive_bin_filter(mode: int = 0, w_size: int = 15, w: float = 0.15) -> _Stage:
+        if mode == 0:
+            # Брэдли-Рот: тот же результат, что у pythreshold, но на месте (см. LocalThreshold)
+            return _Stage('apply_adaptive_bin_filter', {'mode': mode, 'w_size': w_size, 'w': w}, True,
+                          lambda src, dst: LocalThreshold.apply(src, BRADLEY_THRESHOLD, w_size, w),
+                          radius=w_size // 2)
+        # окно метода Сингха в pythreshold -- 15 x 15
+        return _Stage('apply_adaptive_bin_filter', {'mode': mode}, False,
+                      lambda src, dst: np.copyto(dst, apply_threshold(src, singh_threshold(src))), radius=7)
+
+    @staticmethod
+    def apply_local_bin_filter(method: ThresholdMethod = BRADLEY_THRESHOLD, w_size: int = 15,
+                               k: Optional[float] = None, **params) -> _Stage:
+        inspect.signature(LocalThreshold.apply).bind(None, method, w_size, k, **params)
+        # Вольфу нужны минимум яркости и максимум отклонения по всей странице
+        radius = None if method == WOLF_THRESHOLD else w_size // 2
+        return _Stage('apply_local_bin_filter', dict(method=method, w_size=w_size, k=k, **params), True,
+                      lambda src, dst: LocalThreshold.apply(src, method, w_size, k, **params), radius=radius)
+
+
+class Pipeline:
+    """
+    Конвейер предобработки: список операций PicHandler с параметрами, проверяемый один раз при создании.
+    Выполняется над изображениями uint8 в оттенках серого, используя по два переиспользуемых буфера на каждый
+    встречающийся размер изображения (результат одной операции -- вход следующей); операции, которые это допускают,
+    выполняются на месте. Для каждой операции накапливается время выполнения.
+
+        Pipeline([('resize', {'shape': (850, 900)}),
+                  ('apply_adaptive_bin_filter', {'w': 0.15}),
+                  ('apply_filter', {'filter_type': GAUSSIAN_FILTER, 'filter_size': 3}),
+                  ('apply_adaptive_bin_filter', {'w': 0.15})])
+    """
+
+    OPERATIONS = ('resize', 'rescale', 'apply_filter', 'apply_global_bin_filter', 'apply_adaptive_bin_filter',
+                  'apply_local_bin_filter')
+
+    stages: List[_Stage]
+    timings: List[float]  # суммарное время выполнения каждой операции, с
+    n_runs: int
+    _buffers: Dict[Tuple[int, int], List[np.ndarray]]
+
+    def __init__(self, stages: Iterable[Union[str, Tuple[str, Dict[str, Any]]]]):
+        self.stages = []
+        for stage in stages:
+            name, params = (stage, {}) if isinstance(stage, str) else stage
+            if name not in Pipeline.OPERATIONS:
+                raise ValueError("Неизвестная операция конвейера: %s" % name)
+            try:
+                self.stages.append(getattr(_Operations, name)(**params))
+            except TypeError as e:
+                raise ValueError("Некорректные параметры операции %s: %s" % (name, e))
+
+        self.timings = [0.] * len(self.stages)
+        self.n_runs = 0
+        self._buffers = {}
+
+    def __len__(self) -> int:
+        return len(self.stages)
+
+    def signature(self) -> str:
+        # каноническое описание конвейера: одинаково для конвейеров с одинаковыми операциями и параметрами
+        return '|'.join('%s(%s)' % (stage.name, ', '.join('%s=%r' % kv for kv in sorted(stage.params.items())))
+                        for stage in self.stages)
+
+    def _buffer(self, shape: Tuple[int, int], avoid: np.ndarray) -> np.ndarray:
+        # буфер формы shape, не совпадающий с avoid; на каждую форму -- не больше двух буферов
+        pool = self._buffers.setdefault(tuple(shape), [])
+        for buf in pool:
+            if buf is not avoid:
+                return buf
+        buf = np.empty(shape, dtype=np.uint8)
+        pool.append(buf)
+        return buf
+
+    def _detach(self, buf: np.ndarray) -> None:
+        # буфер больше не принадлежит конвейеру
+        pool = self._buffers.get(buf.shape, [])
+        for i in range(len(pool)):
+            if pool[i] is buf:
+                pool.pop(i)
+                return
+
+    def run(self, img: np.ndarray, in_place: bool = False, detach: bool = False) -> np.ndarray:
+        """
+        Выполняет конвейер над изображением
+
+        :param img: изображение uint8 в оттенках серого
+        :param in_place: разрешено изменять img (иначе, а также если img только для чтения, img не меняется)
+        :param detach: результат не будет переиспользован следующими запусками (иначе результат -- один из буферов
+        конвейера и действителен только до следующего запуска)
+        :return: результат; если операций нет -- сам img
+        """
+
+        if img.dtype != np.uint8 or img.ndim != 2:
+            raise ValueError("Конвейер работает с изображениями uint8 в оттенках серого")
+
+        cur, writable = img, in_place and img.flags.writeable
+        for i, stage in enumerate(self.stages):
+            start = time.perf_counter()
+            if stage.in_place:
+                if not writable:
+                    buf = self._buffer(cur.shape, avoid=cur)
+                    np.copyto(buf, cur)
+                    cur, writable = buf, True
+                stage.run(cur, cur)
+            else:
+                buf = self._buffer(stage.out_shape(cur.shape), avoid=cur)
+                stage.run(cur, buf)
+                cur, writable = buf, True
+            self.timings[i] += time.perf_counter() - start
+
+        self.n_runs += 1
+        if detach and cur is not img:
+            self._detach(cur)
+        return cur
+
+    def halo(self) -> int:
+        # ширина поля, с которым фрагмент страницы обрабатывается так же, как вся страница (сумма радиусов операций)
+        res = 0
+        for stage in self.stages:
+            if stage.radius is None:
+                raise ValueError("Операцию %s нельзя выполнять по фрагментам страницы" % stage.name)
+            res += stage.radius
+        return res
+
+    def iter_tiles(self, img: np.ndarray, memory_budget: int = DEFAULT_MEMORY_BUDGET) \
+            -> Iterator[Tuple[Tile, np.ndarray]]:
+        """
+        Выполняет конвейер по перекрывающимся фрагментам страницы: каждый фрагмент обрабатывается вместе с полем
+        ширины halo(), поэтому результат в его core совпадает с результатом run для всей страницы. Рабочая память
+        (буферы конвейера и временные массивы операций) ограничена memory_budget независимо от размера страницы
+
+        :param img: изображение uint8 в оттенках серого; не изменяется (может быть, например, np.memmap)
+        :param memory_budget: бюджет рабочей памяти, байт (см. utils.tiling.tile_side)
+        :return: пары (фрагмент, результат в его core); результат действителен до перехода к следующему фрагменту
+        """
+
+        halo = self.halo()
+        for tile in split_into_tiles(img.shape, tile_side(memory_budget, halo), halo):
+            yield tile, self.run(img[tile.ext_slices()])[tile.core_in_ext()]
+
+    def run_tiled(self, img: np.ndarray, out: Optional[np.ndarray] = None,
+                  memory_budget: int = DEFAULT_MEMORY_BUDGET) -> np.ndarray:
+        """
+        Выполняет конвейер по фрагментам (см. iter_tiles) и собирает результат в out
+
+        :param img: изображение uint8 в оттенках серого
+        :param out: массив для результата формы img.shape; по умолчанию -- сам img (изменяется на месте: результаты
+        полосы фрагментов записываются после обработки следующей полосы, которой еще нужны исходные пикселы),
+        а если img только для чтения -- новый массив
+        :param memory_budget: бюджет рабочей памяти на фрагмент, байт
+        :return: out
+        """
+
+        if out is None:
+            out = img if img.flags.writeable else np.empty_like(img)
+        pending: List[Tuple[Tile, np.ndarray]] = []  # результаты предыдущей полосы фрагментов
+        row: List[Tuple[Tile, np.ndarray]] = []  # результаты текущей полосы
+        for tile, res in self.iter_tiles(img, memory_budget):
+            if row and tile.core[0] != row[0][0].core[0]:
+                for done, done_res in pending:
+                    out[done.core_slices()] = done_res
+                pending, row = row, []
+            row.append((tile, res.copy()))
+
+        for done, done_res in pending + row:
+            out[done.core_slices()] = done_res
+        return out
+
+    def report(self) -> str:
+        # среднее время выполнения каждой операции
+        runs = max(self.n_runs, 1)
+        return '\n'.join('%s: %.2f ms' % (stage.name, 1000 * t / runs) for stage, t in zip(self.stages, self.timings))
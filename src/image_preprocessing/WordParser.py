@@ -4,31 +4,113 @@ from Segmentator import Segmentator
 from PicHandler import *
 from utils.TextBlock import TextBlock
 from PicHandler import PicHandler
+from image_preprocessing.Pipeline import Pipeline
 from FastSegmentator import FastSegmentator
-from utils.geometry import Rect, Point
+from utils.geometry import Rect, Point, RectArray
+from utils.BitPage import BitPage
+from utils.tiling import DEFAULT_MEMORY_BUDGET, split_into_tiles, tile_side, reconcile_tile_boxes
+
+
+UNSCALED_PARAMS = ('PARSING_MODE',)  # параметры сегментации, которые не являются расстояниями и не масштабируются
 
 
 class WordParser:
     @staticmethod
     def parse(parse_method: Callable, img: PicHandler, resize_to: Tuple[int, int] = None, rescale_k: float = None,
               **args) -> List[TextBlock]:
+        # resize_to, rescale_k, параметры сегментации и результат -- в пикселах исходной страницы: при чтении
+        # PicHandler могла уменьшить ее в 1 / img.scale раз
+        return WordParser.to_source(*WordParser.segment(parse_method, img, resize_to, rescale_k, **args))
 
+    @staticmethod
+    def shapes(img: PicHandler, resize_to: Tuple[int, int] = None, rescale_k: float = None) \
+            -> Tuple[Tuple[int, int], Tuple[int, int]]:
+        # размер исходной страницы и размер, до которого она приводится перед сегментацией
         old_shape = img.get_image().shape
+        source_shape = int(round(old_shape[0] / img.scale)), int(round(old_shape[1] / img.scale))
         if resize_to is None:
-            resize_to = int(old_shape[0] * rescale_k), int(old_shape[1] * rescale_k)
+            resize_to = int(source_shape[0] * rescale_k), int(source_shape[1] * rescale_k)
+        return source_shape, (int(resize_to[0]), int(resize_to[1]))
 
-        t_img = PicHandler(img.get_copy(), make_copy=False, is_colored=False)
-        t_img.resize(resize_to)
+    @staticmethod
+    def resized_page(img: PicHandler, resize_to: Tuple[int, int]) -> np.ndarray:
+        # страница не копируется: при изменении размера читается исходное изображение, иначе используется оно само
+        page = img.get_image()
+        if tuple(resize_to) != page.shape[:2]:
+            page = PicHandler.resize_image(page, resize_to)
+        return page
 
-        py, px = old_shape[0] / resize_to[0], old_shape[1] / resize_to[1]
+    @staticmethod
+    def segment(parse_method: Callable, img: PicHandler, resize_to: Tuple[int, int] = None, rescale_k: float = None,
+                **args) -> Tuple[List[TextBlock], Tuple[int, int], Tuple[int, int]]:
+        # первая половина parse: блоки в пикселах страницы, приведенной к размеру resize_to; вместе с ними --
+        # размер исходной страницы и resize_to (см. to_source)
+        source_shape, resize_to = WordParser.shapes(img, resize_to, rescale_k)
+        page = WordParser.resized_page(img, resize_to)
+
+        py, px = source_shape[0] / resize_to[0], source_shape[1] / resize_to[1]
         for k in args:
-            args[k] /= np.sqrt(py * px)
+            if k not in UNSCALED_PARAMS:
+                args[k] /= np.sqrt(py * px)
 
-        res: List[TextBlock] = parse_method(t_img.make_zero_one(), **args)
+        # бинаризация с порогом 220 (как в PicHandler.resize) сразу в матрицу make_zero_one: 1 -- закрашенный пиксел
+        return parse_method((page < 220).astype(np.uint8), **args), source_shape, resize_to
 
+    @staticmethod
+    def to_source(res: List[TextBlock], source_shape: Tuple[int, int], resize_to: Tuple[int, int]) -> List[TextBlock]:
+        # вторая половина parse: прямоугольники блоков переводятся в пикселы исходной страницы (на месте)
+        py, px = source_shape[0] / resize_to[0], source_shape[1] / resize_to[1]
         for tb in res:
             tb.zone.multiply_coordinates(px, py)
-            tb.zone.limit_bottom_right(old_shape[1] - 1, old_shape[0] - 1)
+            tb.zone.limit_bottom_right(source_shape[1] - 1, source_shape[0] - 1)
+        return res
+
+    @staticmethod
+    def parse_tiled(parse_method: Callable, img: PicHandler, pipeline: Optional[Pipeline] = None,
+                    memory_budget: int = DEFAULT_MEMORY_BUDGET, overlap: int = 128, **args) -> List[TextBlock]:
+        """
+        Сегментация очень больших страниц по фрагментам в исходном разрешении: рабочая память ограничена
+        memory_budget независимо от размера страницы. Страница предобрабатывается pipeline по фрагментам и хранится
+        бинаризованной в упакованном виде (BitPage, 1 бит на пиксел); затем каждый фрагмент, расширенный на overlap,
+        сегментируется отдельно, и прямоугольники в полосах перекрытия сводятся (см. utils.tiling.reconcile_tile_boxes)
+
+        :param parse_method: метод сегментации, как в parse
+        :param img: страница в оттенках серого; не изменяется
+        :param pipeline: предобработка страницы (только операции, не меняющие размер); None -- без предобработки
+        :param memory_budget: бюджет рабочей памяти на фрагмент, байт
+        :param overlap: ширина перекрытия фрагментов; должна превышать размер слова и расстояние, на котором
+        сегментатор объединяет компоненты
+        :param args: параметры parse_method, как в parse -- в пикселах исходной страницы
+        :return: блоки с упакованным содержимым; прямоугольники -- в пикселах исходной страницы, как в parse
+        """
+
+        page = img.get_image()
+        h, w = page.shape[:2]
+        for k in args:
+            if k not in UNSCALED_PARAMS:
+                args[k] *= img.scale
+
+        # бинаризация с порогом 220, как в parse, сразу в упакованную страницу
+        bits = BitPage((h, w), np.zeros((h, (w + 7) // 8), dtype=np.uint8))
+        if pipeline is None:
+            pipeline = Pipeline([])
+        for tile, core in pipeline.iter_tiles(page, memory_budget):
+            y0, y1, x0, x1 = tile.core
+            bits.bits[y0: y1, x0 // 8: (x1 + 7) // 8] = np.packbits(core < 220, axis=1)
+
+        tiles = split_into_tiles((h, w), tile_side(memory_budget, overlap), overlap)
+        boxes = []
+        for tile in tiles:
+            y0, y1, x0, x1 = tile.ext
+            blocks = parse_method(bits[y0: y1, x0: x1].to_dense(), **args)
+            boxes.append(RectArray(RectArray.from_text_blocks(blocks).coords + np.array([x0, y0, x0, y0])))
+
+        res = [TextBlock(zone, bits[zone.top(): zone.bottom() + 1, zone.left(): zone.right() + 1])
+               for zone in reconcile_tile_boxes(tiles, (h, w), boxes).to_rects()]
+        source_shape = int(round(h / img.scale)), int(round(w / img.scale))
+        for tb in res:
+            tb.zone.multiply_coordinates(1 / img.scale, 1 / img.scale)
+            tb.zone.limit_bottom_right(source_shape[1] - 1, source_shape[0] - 1)
         return res
 
 
@@ -37,13 +119,13 @@ if __name__ == '__main__':
 
     ph = PicHandler('../test/test1.png')
 
-    def pipeline(ph):
-        ph.resize((850, 900))
-        ph.apply_adaptive_bin_filter(w=0.15)
-        ph.apply_filter(GAUSSIAN_FILTER, 3)
-        ph.apply_adaptive_bin_filter(w=0.15)
+    pipeline = Pipeline([('resize', {'shape': (850, 900)}),
+                         ('apply_adaptive_bin_filter', {'w': 0.15}),
+                         ('apply_filter', {'filter_type': GAUSSIAN_FILTER, 'filter_size': 3}),
+                         ('apply_adaptive_bin_filter', {'w': 0.15})])
 
     ph.exec_pipeline(pipeline)
+    print(pipeline.report())
     ph.show()
 
     start_time = time.time()
@@ -0,0 +1,79 @@
+from __future__ import annotations
+from typing import *
+import cv2 as cv
+import numpy as np
+from utils.geometry import RectArray
+from utils.spatial import RectGrid
+from image_preprocessing.WordSegmentation.FastSegmentation.Contour import Contour
+
+
+class ComponentGraph:
+    """
+    Результат первой фазы FastSegmentator: описанные прямоугольники контуров страницы (в порядке cv.findContours)
+    и разреженный граф расстояний между ними до radius. Вторая фаза (FastSegmentator.parse_graph) повторяет
+    только объединение контуров и дает тот же результат, что FastSegmentator.parse, для любых sens и
+    local_scope_sens не больше radius, не находя контуры и не считая расстояния между ними заново.
+    Граф сохраняется в файл .npz (save / load)
+    """
+
+    shape: Tuple[int, int]  # (h, w) страницы
+    radius: float
+    rects: RectArray  # union_bb контуров
+    pairs: np.ndarray  # int32 (m, 2): пары контуров i < j, прямоугольники которых не дальше radius
+    rect_distances: np.ndarray  # float64 (m,): Rect.distance между прямоугольниками пары
+    contour_distances: np.ndarray  # float64 (m,): точное расстояние между точками контуров пары
+
+    def __init__(self, shape: Tuple[int, int], radius: float, rects: RectArray, pairs: np.ndarray,
+                 rect_distances: np.ndarray, contour_distances: np.ndarray):
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.radius = float(radius)
+        self.rects = rects
+        self.pairs = np.asarray(pairs, dtype=np.int32).reshape((-1, 2))
+        self.rect_distances = np.asarray(rect_distances, dtype=np.float64)
+        self.contour_distances = np.asarray(contour_distances, dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self.rects)
+
+    @staticmethod
+    def build(img: np.ndarray, radius: float) -> ComponentGraph:
+        """
+        Находит контуры img и расстояния между всеми парами контуров, прямоугольники которых не дальше radius
+
+        :param img: бинарное изображение, как для FastSegmentator.parse
+        :param radius: наибольшие sens и local_scope_sens, с которыми граф будет использоваться
+        """
+
+        contours, _ = cv.findContours(img, cv.RETR_LIST, cv.CHAIN_APPROX_SIMPLE)
+        contours = [Contour(cont.reshape((-1, 2))) for cont in contours]
+        rect_list = [c.union_bb for c in contours]
+        rects = RectArray.from_rects(rect_list)
+
+        # кандидаты -- через сетку, как в GridDistanceIndex (погрешность Rect.distance -- не больше пиксела)
+        grid = RectGrid(radius, rect_list)
+        pairs = np.array([(i, j) for i in range(len(rect_list)) for j in grid.query(rect_list[i], radius + 1)
+                          if j > i], dtype=np.int64).reshape((-1, 2))
+        rect_distances = rects[pairs[:, 0]].distance(rects[pairs[:, 1]], outer=False)
+        close = rect_distances <= radius
+        pairs, rect_distances = pairs[close], rect_distances[close]
+
+        contour_distances = np.array([Contour._cont_distance(contours[i].cont_points, contours[j].cont_points)
+                                      for i, j in pairs.tolist()], dtype=np.float64)
+        return ComponentGraph(img.shape[:2], radius, rects, pairs, rect_distances, contour_distances)
+
+    def distances(self, sens: float, fast: bool) -> np.ndarray:
+        # расстояния между парами, как их считает FastSegmentator.parse: в FAST_MODE -- между прямоугольниками,
+        # иначе -- между контурами, если прямоугольники не дальше sens (см. Contour.distance)
+        if fast:
+            return self.rect_distances
+        return np.where(self.rect_distances > sens, self.rect_distances, self.contour_distances)
+
+    def save(self, path: str) -> None:
+        np.savez(path, shape=np.array(self.shape), radius=np.array(self.radius), rects=self.rects.coords,
+                 pairs=self.pairs, rect_distances=self.rect_distances, contour_distances=self.contour_distances)
+
+    @staticmethod
+    def load(path: str) -> ComponentGraph:
+        with np.load(path) as data:
+            return ComponentGraph(tuple(data['shape'].tolist()), float(data['radius']), RectArray(data['rects']),
+                                  data['pairs'], data['rect_distances'], data['contour_distances'])
@@ -23,22 +23,52 @@ class Contour:
         return self
 
     @staticmethod
-    def distance(a: Contour, b: Contour, rude_sens: float) -> float:
+    def distance(a: Contour, b: Contour, rude_sens: float, stop_below: float = -1.) -> float:
+        # stop_below: см. _cont_distance; если сравнивать расстояние нужно только с порогами не меньше stop_below,
+        # точный минимум для близких контуров не нужен
         d = Rect.distance(a.union_bb, b.union_bb)
         if d > rude_sens:
             # грубая оценка расстояния
             return d
         # точная оценка расстояния
-        return Contour._cont_distance(a.cont_points, b.cont_points)
+        return Contour._cont_distance(a.cont_points, b.cont_points, stop_below)
+
+    CONT_DISTANCE_BLOCK = 1 << 16  # сколько попарных расстояний считается за один шаг _cont_distance
 
     @staticmethod
-    def _cont_distance(a: np.ndarray, b: np.ndarray):
-        def _min_squared_distance_to_vector(xy, to):
-            return np.min(np.square(xy[0] - to[:, 0]) + np.square(xy[1] - to[:, 1]))
+    def _cont_distance(a: np.ndarray, b: np.ndarray, stop_below: float = -1.) -> float:
+        # минимальное расстояние между точками a и b. Как только найдена пара точек на расстоянии не больше
+        # stop_below, возвращается ее расстояние: оно не больше stop_below, но может быть больше точного минимума
+        a = np.asarray(a, dtype=np.int64).reshape((-1, 2))
+        b = np.asarray(b, dtype=np.int64).reshape((-1, 2))
+        if len(a) > len(b):
+            a, b = b, a
+
+        stop = stop_below * stop_below if stop_below >= 0 else -1
+        best = int(np.min(np.square(b - a[0]).sum(axis=1)))  # начальная оценка сверху
+        if best <= stop:
+            return np.sqrt(best)
+
+        # ближе текущей оценки к a могут быть только точки b в описанном прямоугольнике a, расширенном на нее
+        # (и наоборот), остальные точки можно не рассматривать
+        def _near(points: np.ndarray, to: np.ndarray, radius: float) -> np.ndarray:
+            lo, hi = to.min(axis=0) - radius, to.max(axis=0) + radius
+            return points[np.all((points >= lo) & (points <= hi), axis=1)]
+
+        radius = np.sqrt(best)
+        b = _near(b, a, radius)
+        a = _near(a, b, radius)
+
+        # попарные расстояния считаются блоками по строкам a, чтобы ограничить память и выйти как можно раньше
+        step = max(1, Contour.CONT_DISTANCE_BLOCK // max(len(b), 1))
+        for i in range(0, len(a), step):
+            block = a[i: i + step]
+            d = np.square(block[:, None, 0] - b[None, :, 0]) + np.square(block[:, None, 1] - b[None, :, 1])
+            best = min(best, int(d.min()))
+            if best <= stop:
+                break
 
-        min_squared_distances = np.apply_along_axis(lambda _axy: _min_squared_distance_to_vector(_axy, b), 1, a)
-        res = min_squared_distances.min()
-        return np.sqrt(res)
+        return np.sqrt(best)
 
     @staticmethod
     def find_rect(component: np.ndarray) -> Rect:
@@ -3,15 +3,27 @@ from typing import *
 import cv2 as cv
 from utils.TextBlock import TextBlock
 from utils.algs import postprocess_segmentation
-from utils.geometry import Rect
+from utils.geometry import Rect, Point
+from utils.labeling import find_close_components
 import numpy as np
 from image_preprocessing.WordSegmentation.FastSegmentation.Contour import Contour
-from image_preprocessing.WordSegmentation.SegAnalyzer import SegAnalyzer
+from image_preprocessing.WordSegmentation.FastSegmentation.ComponentGraph import ComponentGraph
+from image_preprocessing.WordSegmentation.SegAnalyzer import UnitePolicy
 
 
 PARSING_MODE = 'PARSING_MODE'
 FAST_MODE = 1
 DEFAULT_MODE = 0
+# близость компонент находится одним преобразованием расстояний по всей странице (см. _parse_by_proximity).
+# Результат близок к DEFAULT_MODE, но не совпадает с ним:
+# - объединяются компоненты связности, а не контуры: дырки букв не становятся отдельными объектами, поэтому
+#   на небинаризованной странице, почти целиком закрашенной при пороге 220, результаты совсем разные;
+# - расстояние -- точное между пикселами, а не между вершинами контуров CHAIN_APPROX_SIMPLE, и может быть меньше;
+# - пары, заслоненные третьей компонентой, не находятся, а критерий объединения (пунктуация, диакритика) зависит
+#   от прямоугольников уже объединенных групп, поэтому такие пары не всегда объединяются через третью.
+# На бинаризованных тестовых страницах совпадает 83-100% прямоугольников. Преобразование расстояний идет по всей
+# странице, поэтому режим быстрее DEFAULT_MODE только на плотных страницах; на редких (test1.png) -- медленнее
+PROXIMITY_MODE = 2
 
 
 class FastSegmentator:
@@ -26,21 +38,31 @@ class FastSegmentator:
         else:
             m = DEFAULT_MODE
 
+        if m == PROXIMITY_MODE:
+            return FastSegmentator._parse_by_proximity(img, sens, float(max(kwargs.values())))
+
         contours, hier = cv.findContours(img, cv.RETR_LIST, cv.CHAIN_APPROX_SIMPLE)
         contours = [Contour(cont.reshape((-1, 2))) for cont in contours]
 
         uf = lambda a, b: a.union(b)
+        local_scope_sens = float(max(kwargs.values()))
         if m == DEFAULT_MODE:
-            criterion = lambda a, b, dist: SegAnalyzer.unite_segments(a.union_bb, b.union_bb, sens, dist)
-            distance = lambda a, b: Contour.distance(a, b, sens)
+            criterion = UnitePolicy(sens, key=lambda a: a.union_bb)
+            # расстояния сравниваются только с sens и local_scope_sens, поэтому для близких контуров точный минимум
+            # не нужен
+            stop_below = min(sens, local_scope_sens)
+            distance = lambda a, b: Contour.distance(a, b, sens, stop_below)
+            bbox = lambda a: a.union_bb
             cs = contours
         else:
-            criterion = lambda a, b, dist: SegAnalyzer.unite_segments(a, b, sens, dist)
+            criterion = UnitePolicy(sens)
             distance = Rect.distance
+            bbox = lambda a: a
             cs = [c.union_bb for c in contours]
 
         contours = postprocess_segmentation(
-            cs, criterion, float(max(kwargs.values())), union_function=uf, distance_metric=distance
+            cs, criterion, local_scope_sens, union_function=uf, distance_metric=distance,
+            bbox_function=bbox
         )
 
         if m == DEFAULT_MODE:
@@ -49,3 +71,47 @@ class FastSegmentator:
             rects = contours
 
         return [TextBlock(rect, img[rect.top(): rect.bottom(), rect.left(): rect.right()]) for rect in rects]
+
+    @staticmethod
+    def parse_graph(img: np.ndarray, graph: ComponentGraph, sens: Union[int, float], **kwargs) -> List[TextBlock]:
+        """
+        Вторая фаза сегментации: то же, что parse(img, sens, **kwargs) в режимах DEFAULT_MODE и FAST_MODE, но
+        контуры и расстояния между ними берутся из графа, построенного ComponentGraph.build(img, radius), поэтому
+        заново выполняется только объединение контуров
+
+        :param img: страница, по которой построен graph (из нее вырезается содержимое блоков)
+        :param graph: граф контуров страницы
+        :param sens: чувствительность; sens и local_scope_sens не должны превышать graph.radius
+        """
+
+        m = kwargs.get(PARSING_MODE, DEFAULT_MODE)
+        if m not in (DEFAULT_MODE, FAST_MODE):
+            raise ValueError("Граф контуров не применим в режиме %s" % m)
+        local_scope_sens = float(max(kwargs.values()))
+        if max(sens, local_scope_sens) > graph.radius:
+            raise ValueError("Граф построен для расстояний не больше %s" % graph.radius)
+
+        # критерий смотрит только на описанные прямоугольники, поэтому вместо контуров объединяются они
+        distances = graph.distances(sens, m == FAST_MODE)
+        rects = postprocess_segmentation(
+            graph.rects.to_rects(), UnitePolicy(sens), local_scope_sens,
+            neighbours=(graph.pairs.tolist(), distances.tolist())
+        )
+
+        return [TextBlock(rect, img[rect.top(): rect.bottom(), rect.left(): rect.right()]) for rect in rects]
+
+    @staticmethod
+    def _parse_by_proximity(img: np.ndarray, sens: Union[int, float], local_scope_sens: float) -> List[TextBlock]:
+        # вместо попарных расстояний между контурами -- пары близких компонент связности, найденные по карте
+        # расстояний; прямоугольники -- в тех же координатах, что у Contour.find_rect
+        borders, pairs, distances = find_close_components(img, local_scope_sens)
+        # результат объединения зависит от порядка объектов, а cv.findContours перечисляет контуры примерно в порядке,
+        # обратном обходу страницы по строкам: компоненты перебираются так же
+        rects = [Rect(Point(min_x, min_y), Point(max_x + 1, max_y + 1))
+                 for min_x, min_y, max_x, max_y in borders[::-1].tolist()]
+        pairs = len(borders) - 1 - pairs
+        rects = postprocess_segmentation(
+            rects, UnitePolicy(sens), local_scope_sens, neighbours=(pairs.tolist(), distances.tolist())
+        )
+
+        return [TextBlock(rect, img[rect.top(): rect.bottom(), rect.left(): rect.right()]) for rect in rects]
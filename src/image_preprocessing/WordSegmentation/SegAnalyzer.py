@@ -2,7 +2,10 @@ from __future__ import annotations
 from typing import *
 import numpy as np
 from utils.geometry import Rect, Point
-from utils.algs import postprocess_segmentation
+from utils.algs import postprocess_segmentation, MergeEngine, build_integral
+from utils.spatial import RectDistanceIndex, IntervalChainIndex
+from utils.RLEPage import RLEPage
+from utils.BitPage import BitPage
 
 MIN_LINE_DIST = 'MIN_LINE_DIST'  # минимальный межстрочный интервал в пикселах
 MIN_LINE_HEIGHT = 'MIN_LINE_HEIGHT'
@@ -21,25 +24,112 @@ DEFAULT_PARAMS = {
 }
 
 
+class UnitePolicy:
+    """
+    Критерий объединения фрагментов SegAnalyzer.unite_segments с фиксированной чувствительностью, не требующий
+    анализа документа; подходит как criterion для postprocess_segmentation
+    """
+
+    sens: float
+    key: Optional[Callable[[Any], Rect]]  # прямоугольник, по которому сравниваются объекты; None -- сами объекты
+
+    def __init__(self, sens: float, key: Optional[Callable[[Any], Rect]] = None):
+        self.sens = sens
+        self.key = key
+
+    def __call__(self, a: Any, b: Any, dist: float) -> bool:
+        if self.key is not None:
+            a, b = self.key(a), self.key(b)
+        return SegAnalyzer.unite_segments(a, b, self.sens, dist)
+
+
 class SegAnalyzer:
     # Экземпляру этого класса нужно скормить бинарный документ (1 -- пиксел закрашен, 0 -- незакрашен).
     # Объект определяет расположение строк и слов (на основе подсчитанных сумм пикселей по горизонтали и вертикали)
 
-    strings_on_doc: List[Tuple[int, int]]  # для каждой строки текста: y-координата начала и конца
-    words_in_strings: List[List[Tuple[int, int]]]  # начало и конец слова в каждой строке
-    img: np.ndarray
+    # strings_on_doc: для каждой строки текста -- y-координата начала и конца
+    # words_in_strings: начало и конец слова в каждой строке
+    # integral: integral[y, x] -- число закрашенных пикселов в img[:y, :x] (только для плотной матрицы img)
+    img: Union[np.ndarray, RLEPage, BitPage]
     params: Dict
+    root: SegAnalyzer  # анализатор всей страницы (для самой страницы -- self)
+    offset: Tuple[int, int]  # (x, y) левого верхнего угла img на странице root.img
+    depth: int  # глубина вложенности анализа зон в _check_line_errors
+    skipped_subanalyses: int  # только у root: сколько раз анализ зоны был взят из памяти или пропущен
 
     DIACRITICS_PROP = 0.1  # максимальная высота диакритического знака относительно высоты символа
     MIN_OUTSTR_DIST = 5
     MAX_OUTSTR_PROP = 1.8
-
-    def __init__(self, doc: np.ndarray, params: Dict = None):
+    MAX_CHECK_DEPTH = 8  # глубже зоны в _check_line_errors не разбираются
+
+    def __init__(self, doc: Union[np.ndarray, RLEPage, BitPage], params: Dict = None, parent: Optional[SegAnalyzer] = None,
+                 offset: Tuple[int, int] = (0, 0)):
+        # parent задан => doc -- фрагмент parent.img с левым верхним углом в offset (режим подвида): суммы берутся
+        # из уже посчитанной таблицы parent, а не считаются заново.
+        # Анализ документа выполняется при первом обращении к strings_on_doc или words_in_strings.
+        # doc может быть задан в сжатом виде (RLEPage, BitPage): тогда все суммы запрашиваются у него самого
+        # (row_sums, band_col_sums, rect_sum), и таблица integral не строится
         if params is None:
             params = DEFAULT_PARAMS
         self.img = doc
         self.params = params
-        self._analyze()
+        self._parent = parent
+        self._integral = None
+        self._strings_on_doc = None
+        self._words_in_strings = None
+
+        if parent is None:
+            self.root = self
+            self.offset = (0, 0)
+            self.depth = 0
+            h, w = doc.shape
+            # зона -> найденные в ней слова (в координатах страницы); None -- зона анализируется сейчас, ее повторный
+            # анализ привел бы к бесконечной рекурсии. Сама страница тоже считается такой зоной
+            self._subanalyses: Dict[Tuple[int, int, int, int], Optional[List[Tuple[int, int, int, int]]]] = \
+                {(0, 0, w - 1, h - 1): None}
+            self.skipped_subanalyses = 0
+        else:
+            self.root = parent.root
+            self._local_offset = offset
+            self.offset = (parent.offset[0] + offset[0], parent.offset[1] + offset[1])
+            self.depth = parent.depth + 1
+
+    @property
+    def integral(self) -> np.ndarray:
+        if self._integral is None:
+            if self._parent is None:
+                self._integral = build_integral(self.img, np.int32)
+            else:
+                x, y = self._local_offset
+                self._integral = SegAnalyzer.slice_integral(self._parent.integral, y, x, *self.img.shape)
+        return self._integral
+
+    @property
+    def strings_on_doc(self) -> List[Tuple[int, int]]:
+        if self._strings_on_doc is None:
+            self._analyze()
+        return self._strings_on_doc
+
+    @property
+    def words_in_strings(self) -> List[List[Tuple[int, int]]]:
+        if self._words_in_strings is None:
+            self._analyze()
+        return self._words_in_strings
+
+    @staticmethod
+    def slice_integral(integral: np.ndarray, y: int, x: int, h: int, w: int) -> np.ndarray:
+        # таблица сумм фрагмента [y: y + h, x: x + w] изображения, полученная из таблицы всего изображения
+        rows, cols = integral[y: y + h + 1], integral[y, x: x + w + 1]
+        return rows[:, x: x + w + 1] - rows[:, x: x + 1] - cols + integral[y, x]
+
+    def rect_sum(self, y0: int, y1: int, x0: int, x1: int) -> int:
+        # число закрашенных пикселов в img[y0: y1, x0: x1] (границы уже должны лежать внутри изображения) за O(1)
+        if not isinstance(self.img, np.ndarray):
+            return self.img.rect_sum(y0, y1, x0, x1)
+        if y1 <= y0 or x1 <= x0:
+            return 0
+        integral = self.integral
+        return int(integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0])
 
     @staticmethod
     def find_areas(sums: np.ndarray, thresh: float, min_val: int) -> List[Tuple[int, int]]:
@@ -52,70 +142,89 @@ class SegAnalyzer:
         :return: множество областей локальных максимумов, выделенных в sums
         """
 
-        res = []
-        start = None
-        line_beg = False
-        thresh = thresh * np.mean(sums)
-
-        for l in range(len(sums)):
-            if sums[l] > thresh or sums[l] > min_val:
-                if not line_beg:
-                    line_beg = True
-                    start = l
-            else:
-                if line_beg:
-                    line_beg = False
-                    res.append((start, l))
-
-        if line_beg:
-            res.append((start, len(sums) - 1))
-        return res
+        if not len(sums):
+            return []
 
-    def _analyze(self) -> None:
-        # заполняет список строк self.strings_on_doc
-        doc = self.img
-        params = self.params
-        sums = doc.sum(axis=1)  # построчные суммы; в тех строках пикселов, где большие суммы, идет строка
-        self.strings_on_doc = SegAnalyzer.find_areas(sums, thresh=0.01, min_val=params[MIN_HOR_SUM])
-        SegAnalyzer._unite_lines(self.strings_on_doc, params)
+        above = (sums > thresh * np.mean(sums)) | (sums > min_val)
+        return SegAnalyzer._find_runs(above[None, :])[0]
 
-        self.words_in_strings = []
+    @staticmethod
+    def find_areas_batch(sums: np.ndarray, thresh: float, min_val: int) -> List[List[Tuple[int, int]]]:
+        """
+        То же, что find_areas, сразу для набора массивов сумм одинаковой длины (например, для всех строк страницы)
 
-        for top, bot in self.strings_on_doc:
-            string: np.ndarray = doc[top: bot]
-            vert_sums = string.sum(axis=0)
+        :param sums: матрица; каждая строка -- массив сумм закрашенных пикселей
+        :param thresh: критерий определения края зоны (относительно среднего по своей строке sums)
+        :param min_val: число, значение сумм больше которого означает, что в данной позиции находится локальный максимум
+        :return: для каждой строки sums -- области, которые выделил бы в ней find_areas
+        """
 
-            words = SegAnalyzer.find_areas(vert_sums, thresh=0.01, min_val=params[MIN_VERT_SUM])
+        if not sums.shape[1]:
+            return [[] for _ in range(sums.shape[0])]
 
-            SegAnalyzer._unite_words(words, params, bot - top)
-            self.words_in_strings.append(words)
+        above = (sums > thresh * np.mean(sums, axis=1, keepdims=True)) | (sums > min_val)
+        return SegAnalyzer._find_runs(above)
 
     @staticmethod
-    def _unite_pseudo_words(words: List[Rect], params: Dict) -> None:
-        while True:
-            changed = False
+    def _find_runs(above: np.ndarray) -> List[List[Tuple[int, int]]]:
+        # для каждой строки булевой матрицы -- отрезки подряд идущих True: (начало, первая позиция после конца);
+        # отрезок, доходящий до конца строки, заканчивается на последней позиции (как в find_areas)
+        rows, length = above.shape
+        edges = np.diff(above.astype(np.int8), axis=1, prepend=0, append=0)
+        start_rows, starts = np.nonzero(edges == 1)
+        ends = np.nonzero(edges == -1)[1]  # на каждой строке концов столько же, сколько начал
+        ends[ends == length] = length - 1
+
+        bounds = np.searchsorted(start_rows, np.arange(rows + 1)).tolist()
+        starts, ends = starts.tolist(), ends.tolist()
+        return [list(zip(starts[bounds[r]: bounds[r + 1]], ends[bounds[r]: bounds[r + 1]])) for r in range(rows)]
+
+    def _row_sums(self) -> np.ndarray:
+        if not isinstance(self.img, np.ndarray):
+            return self.img.row_sums()
+        return np.diff(self.integral[:, -1])
+
+    def _band_col_sums(self, tops: np.ndarray, bots: np.ndarray) -> np.ndarray:
+        # i-я строка -- суммы по столбцам строк пикселов [tops[i], bots[i])
+        if not isinstance(self.img, np.ndarray):
+            return self.img.band_col_sums(tops, bots)
+        # накопленные по столбцам суммы -- разности строк integral
+        integral = self.integral
+        return np.diff(integral[bots], axis=1) - np.diff(integral[tops], axis=1)
 
-            i = 0
-            while i < len(words):
-                j = i + 1
-                while j < len(words):
-                    ti = words[i]
-                    tj = words[j]
+    def _analyze(self) -> None:
+        # заполняет список строк self.strings_on_doc и список слов в них self.words_in_strings
+        params = self.params
+        sums = self._row_sums()  # построчные суммы; в тех строках пикселов, где большие суммы, идет строка
+        strings_on_doc = SegAnalyzer.find_areas(sums, thresh=0.01, min_val=params[MIN_HOR_SUM])
+        SegAnalyzer._unite_lines(strings_on_doc, params)
 
-                    if SegAnalyzer.unite_segments(ti, tj, params[MIN_WORDS_DIST], dist=Rect.distance(ti, tj)):
-                        # Rect.distance(ti, tj) <= params[MIN_WORDS_DIST]:
-                        # объединяем области
-                        words[i] = words[i].union(words[j])
-                        words.pop(j)
-                        changed = True
+        words_in_strings = []
+        if strings_on_doc:
+            # вертикальные суммы всех строк текста сразу
+            tops, bots = np.array(strings_on_doc).T
+            vert_sums = self._band_col_sums(tops, bots)
 
-                    else:
-                        j += 1
+            all_words = SegAnalyzer.find_areas_batch(vert_sums, thresh=0.01, min_val=params[MIN_VERT_SUM])
+            for (top, bot), words in zip(strings_on_doc, all_words):
+                SegAnalyzer._unite_words(words, params, bot - top)
+                words_in_strings.append(words)
 
-                i += 1
+        self._strings_on_doc, self._words_in_strings = strings_on_doc, words_in_strings
 
-            if not changed:
-                return
+    @staticmethod
+    def _unite_pseudo_words(words: List[Rect], params: Dict) -> MergeEngine:
+        # объединяет соседние области, пока это возможно; пары дальше 3 * MIN_WORDS_DIST объединять не нужно
+        # (см. unite_segments), поэтому кандидаты ищутся через сетку, а не перебором всех пар
+        sens = params[MIN_WORDS_DIST]
+        engine = MergeEngine(
+            words,
+            criterion=lambda a, b, dist: SegAnalyzer.unite_segments(a, b, sens, dist=dist),
+            index=RectDistanceIndex(words, local_scope_sens=3 * sens),
+            forward_only=True
+        )
+        words[:] = engine.run()
+        return engine
 
     @staticmethod
     def _unite_words(words_in_string: List[Tuple[int, int]], params: Dict, line_h: int,
@@ -136,29 +245,21 @@ class SegAnalyzer:
                 words_in_string.append((r.left(), r.right()))
 
     @staticmethod
-    def _unite_lines(strings_on_doc: List[Tuple[int, int]], params: Dict):
+    def _unite_lines(strings_on_doc: List[Tuple[int, int]], params: Dict) -> MergeEngine:
         # если мы нечаянно выделили слишком маленькие строки или слишком малые интервалы
-        while True:
-            changed = False
-
-            i = 0
-            while i < len(strings_on_doc):
-                j = i + 1
-                while j < len(strings_on_doc):
-                    si = strings_on_doc[i]
-                    sj = strings_on_doc[j]
-                    if si[1] - si[0] < params[MIN_LINE_HEIGHT] or sj[0] - si[1] < params[MIN_LINE_DIST]:
-                        # объединяем области
-                        strings_on_doc.pop(j)
-                        strings_on_doc[i] = si[0], sj[1]
-                        changed = True
-                    else:
-                        break
-
-                i += 1
-
-            if not changed:
-                return
+        def check_unite_lines(a: Tuple[int, int], b: Tuple[int, int], dist: float) -> bool:
+            si, sj = (a, b) if a[0] <= b[0] else (b, a)
+            return si[1] - si[0] < params[MIN_LINE_HEIGHT] or sj[0] - si[1] < params[MIN_LINE_DIST]
+
+        engine = MergeEngine(
+            strings_on_doc,
+            criterion=check_unite_lines,
+            index=IntervalChainIndex(strings_on_doc),
+            union_function=lambda a, b: (min(a[0], b[0]), max(a[1], b[1])),
+            forward_only=True
+        )
+        strings_on_doc[:] = engine.run()
+        return engine
 
     @staticmethod
     def unite_segments(a: Rect, b: Rect, sens: float, dist: float = None) -> bool:
@@ -203,17 +304,43 @@ class SegAnalyzer:
         # возможно, мы некорректно выделили границы строк, и два слова в соседних строках было выделено как одно
         res = []
         for zone in zones:
-            zone_words = SegAnalyzer(self.img[zone.top(): zone.bottom() + 1, zone.left(): zone.right() + 1],
-                                     self.params).trivial_parse()
+            zone_words = self._parse_subzone(zone)
             if len(zone_words) > 1:
                 # мы нашли больше одного слова в сегменте => была ошибка разметки линий
-                for r in zone_words:
-                    r.move(zone.left(), zone.top())
                 res += zone_words
             else:
                 res.append(zone)
         return res
 
+    def _parse_subzone(self, zone: Rect) -> List[Rect]:
+        # слова, найденные trivial_parse внутри зоны (в координатах self); пустой список, если зона не разбиралась.
+        # Результаты запоминаются в root по координатам зоны на странице, так что одна и та же зона, найденная
+        # на разных уровнях вложенности, анализируется один раз
+        root = self.root
+        h, w = self.img.shape
+        y0, y1, _ = slice(zone.top(), zone.bottom() + 1).indices(h)
+        x0, x1, _ = slice(zone.left(), zone.right() + 1).indices(w)
+        ox, oy = self.offset
+        key = (ox + x0, oy + y0, ox + x1 - 1, oy + y1 - 1)
+
+        if key in root._subanalyses:
+            found = root._subanalyses[key]
+            root.skipped_subanalyses += 1
+            if found is None:
+                return []
+        elif self.depth >= SegAnalyzer.MAX_CHECK_DEPTH or y1 <= y0 or x1 <= x0:
+            root.skipped_subanalyses += 1
+            return []
+        else:
+            root._subanalyses[key] = None
+            sub = SegAnalyzer(self.img[y0: y1, x0: x1], self.params, parent=self, offset=(x0, y0))
+            found = root._subanalyses[key] = [
+                (r.left() + key[0], r.top() + key[1], r.right() + key[0], r.bottom() + key[1])
+                for r in sub.trivial_parse()
+            ]
+
+        return [Rect(Point(l - ox, t - oy), Point(r - ox, b - oy)) for l, t, r, b in found]
+
     @staticmethod
     def find_word(words: List[Rect], zone: Rect, iou_thresh: float = 0.5) -> int:
         for i in range(len(words)):
@@ -223,11 +350,19 @@ class SegAnalyzer:
         return -1
 
     def specify_borders(self, zone: Rect, step: int = 5) -> Rect:
+        # уточняет границы зоны: раздвигает их, пока они пересекают символы, затем сужает до ближайших символов;
+        # каждая проверка линии на пустоту -- запрос rect_sum, сужение -- двоичный поиск
+        h, w = self.img.shape
         while True:
-            t = self.__specify(self.img[:, zone.left(): zone.right()], zone.top(), out_is_upper=True, step=step)
-            b = self.__specify(self.img[:, zone.left(): zone.right()], zone.bottom(), out_is_upper=False, step=step)
-            l = self.__specify(self.img[t: b].transpose(), zone.left(), out_is_upper=True, step=step)
-            r = self.__specify(self.img[t: b].transpose(), zone.right(), out_is_upper=False, step=step)
+            x0, x1, _ = slice(zone.left(), zone.right()).indices(w)
+            rows_sum = lambda y0, y1: self.rect_sum(y0, y1, x0, x1)
+            t = self.__specify(rows_sum, h, zone.top(), out_is_upper=True, step=step)
+            b = self.__specify(rows_sum, h, zone.bottom(), out_is_upper=False, step=step)
+
+            y0, y1, _ = slice(t, b).indices(h)
+            cols_sum = lambda _x0, _x1: self.rect_sum(y0, y1, _x0, _x1)
+            l = self.__specify(cols_sum, w, zone.left(), out_is_upper=True, step=step)
+            r = self.__specify(cols_sum, w, zone.right(), out_is_upper=False, step=step)
             new = Rect(Point(l, t), Point(r, b))
 
             if new == zone:
@@ -237,34 +372,52 @@ class SegAnalyzer:
         return new
 
     @staticmethod
-    def __specify(arr_norm: np.ndarray, tbord: int, out_is_upper: bool, step: int = 1) -> int:
-        # arr_norm -- нормализованная матрица: она повернута так, что интересующая нас ось -- вертикальная
+    def __specify(band_sum: Callable[[int, int], int], n: int, tbord: int, out_is_upper: bool, step: int = 1) -> int:
+        # band_sum(a, b) -- число закрашенных пикселов в линиях [a, b) вдоль интересующей нас оси, n -- число линий
 
         def bound_tbord(tbord) -> int:
             if tbord < 0:
                 tbord = 0
-            elif tbord >= arr_norm.shape[0]:
-                tbord = arr_norm.shape[0] - 1
+            elif tbord >= n:
+                tbord = n - 1
 
             return tbord
 
         tbord = bound_tbord(tbord)
 
-        while np.count_nonzero(arr_norm[tbord]):
+        while band_sum(tbord, tbord + 1):
             # есть пересечение с линией на границе зоны, значит границу надо отодвинуть наружу
             tbord -= step if out_is_upper else -step
-            if tbord < 0 or tbord >= arr_norm.shape[0]:
+            if tbord < 0 or tbord >= n:
                 tbord = bound_tbord(tbord)
                 break
 
-        while not np.count_nonzero(arr_norm[tbord]) and tbord not in (0, arr_norm.shape[0]):
-            # нет пересечения с линией символа => границу надо сузить
-            tbord += 1 if out_is_upper else -1
-            if tbord < 0 or tbord >= arr_norm.shape[0]:
-                tbord = bound_tbord(tbord)
-                break
+        if tbord == 0 or band_sum(tbord, tbord + 1):
+            return tbord
 
-        return tbord
+        # нет пересечения с линией символа => границу надо сузить до ближайшей непустой линии внутри зоны
+        # (нижняя или правая граница сужается не дальше линии 0, верхняя или левая -- не дальше последней линии)
+        if out_is_upper:
+            lo, hi = tbord, n - 1
+            if not band_sum(lo, n):
+                return hi
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if band_sum(tbord, mid + 1):
+                    hi = mid
+                else:
+                    lo = mid + 1
+        else:
+            lo, hi = 1, tbord
+            if not band_sum(lo, tbord + 1):
+                return 0
+            while lo < hi:
+                mid = (lo + hi + 1) // 2
+                if band_sum(mid, tbord + 1):
+                    lo = mid
+                else:
+                    hi = mid - 1
+        return lo
 
     @staticmethod
     def _is_diacritic(_prev_word: Rect, _segment: Rect, sens: Union[int, float]) -> bool:
@@ -0,0 +1,109 @@
+from __future__ import annotations
+from typing import *
+from collections import OrderedDict
+from numbers import Real
+import hashlib
+import numpy as np
+from image_preprocessing.PicHandler import PicHandler
+from image_preprocessing.PageCache import CacheStats
+from image_preprocessing.WordSegmentation.WordParser import WordParser
+from utils.TextBlock import TextBlock
+from utils.geometry import RectArray
+
+
+class SegmentationCache:
+    """
+    Кеш результатов WordParser.parse: сегментация детерминирована для данной страницы и набора параметров, поэтому
+    повторно присланная страница не сегментируется заново. Ключ -- хеш страницы (img.get_image()) вместе с ее
+    масштабом, метод сегментации и канонизированные параметры (итоговый размер страницы вместо resize_to/rescale_k,
+    числа -- как float, параметры по алфавиту). Хранятся только прямоугольники слов и окна их содержимого на
+    странице, приведенной к размеру сегментации, в LRU на max_entries страниц. При промахе возвращается результат
+    WordParser.parse, при попадании -- блоки с теми же прямоугольниками и тем же содержимым, которое вырезается из
+    страницы при обращении (см. blocks)
+    """
+
+    max_entries: int
+    stats: CacheStats
+    _results: OrderedDict  # ключ -> (прямоугольники в пикселах исходной страницы, окна содержимого, resize_to)
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.stats = CacheStats()
+        self._results = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    @staticmethod
+    def page_hash(img: PicHandler) -> str:
+        page = np.ascontiguousarray(img.get_image())
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(('%s|%s|%r' % (page.shape, page.dtype, img.scale)).encode())
+        digest.update(memoryview(page).cast('B'))
+        return digest.hexdigest()
+
+    @staticmethod
+    def canonical_params(params: Dict[str, Any]) -> str:
+        def canonical(v: Any) -> str:
+            if isinstance(v, Real):
+                return repr(float(v))
+            if isinstance(v, (tuple, list)):
+                return '(%s)' % ', '.join(canonical(x) for x in v)
+            return repr(v)
+
+        return ', '.join('%s=%s' % (k, canonical(v)) for k, v in sorted(params.items()))
+
+    def key(self, parse_method: Callable, img: PicHandler, resize_to: Optional[Tuple[int, int]] = None,
+            rescale_k: Optional[float] = None, **args) -> str:
+        # итоговый размер страницы вычисляется так же, как в WordParser.parse
+        _, resize_to = WordParser.shapes(img, resize_to, rescale_k)
+        method = '%s.%s' % (parse_method.__module__, parse_method.__qualname__)
+        return '%s|%s|%s' % (self.page_hash(img), method, self.canonical_params(dict(args, resize_to=resize_to)))
+
+    def parse(self, parse_method: Callable, img: PicHandler, resize_to: Optional[Tuple[int, int]] = None,
+              rescale_k: Optional[float] = None, **args) -> List[TextBlock]:
+        """
+        WordParser.parse с кешированием результата
+
+        :return: при промахе -- результат WordParser.parse, при попадании -- такие же блоки (см. blocks)
+        """
+
+        key = self.key(parse_method, img, resize_to, rescale_k, **args)
+        result = self._results.get(key)
+        if result is not None:
+            self.stats.hits += 1
+            self._results.move_to_end(key)
+            return SegmentationCache.blocks(img, *result)
+
+        self.stats.misses += 1
+        res, source_shape, resize_to = WordParser.segment(parse_method, img, resize_to, rescale_k, **args)
+        # окно содержимого -- (l, t, r, b) на странице размера resize_to, концы не включаются: содержимое
+        # начинается в левом верхнем углу прямоугольника и имеет свой собственный размер
+        windows = np.array([(tb.zone.left(), tb.zone.top(), tb.zone.left() + tb.contents.shape[1],
+                             tb.zone.top() + tb.contents.shape[0]) for tb in res], dtype=np.int32).reshape((-1, 4))
+        res = WordParser.to_source(res, source_shape, resize_to)
+
+        self._results[key] = (RectArray.from_text_blocks(res), RectArray(windows), resize_to)
+        if len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+            self.stats.evictions += 1
+        return res
+
+    @staticmethod
+    def blocks(img: PicHandler, zones: RectArray, windows: RectArray, resize_to: Tuple[int, int]) -> List[TextBlock]:
+        # блоки с прямоугольниками zones; содержимое -- окна windows страницы img, приведенной к resize_to и
+        # бинаризованной с порогом 220, как в WordParser.parse. Окно вырезается при обращении к содержимому, а
+        # страница приводится к resize_to (если ее размер другой) один раз -- при первом таком обращении
+        page = []
+
+        def window(l: int, t: int, r: int, b: int) -> Callable[[], np.ndarray]:
+            def contents() -> np.ndarray:
+                if not page:
+                    page.append(WordParser.resized_page(img, resize_to))
+                return (page[0][t: b, l: r] < 220).astype(np.uint8)
+            return contents
+
+        return [TextBlock(zone, window(*w)) for zone, w in zip(zones.to_rects(), windows.coords.tolist())]
+
+    def clear(self) -> None:
+        self._results.clear()
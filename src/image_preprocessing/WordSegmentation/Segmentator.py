@@ -5,9 +5,10 @@ from typing import List
 import numpy as np
 from utils.TextBlock import TextBlock
 from itertools import product
-from utils.algs import get_connect_components, postprocess_segmentation
+from utils.algs import postprocess_segmentation
+from utils.labeling import find_components_borders
 from utils.geometry import Point, Rect
-from SegAnalyzer import SegAnalyzer
+from SegAnalyzer import SegAnalyzer, UnitePolicy
 from image_preprocessing.PicHandler import PicHandler
 
 
@@ -25,37 +26,33 @@ class Segmentator:
                     yield nx, ny
 
     @staticmethod
-    def find_borders(component: Iterable[Tuple[int, int]]) -> Tuple[int, int, int, int]:
-        min_x = min(component, key=lambda t: t[0])[0]
-        max_x = max(component, key=lambda t: t[0])[0]
-
-        min_y = min(component, key=lambda t: t[1])[1]
-        max_y = max(component, key=lambda t: t[1])[1]
+    def find_borders(component: Union[Iterable[Tuple[int, int]], np.ndarray]) -> Tuple[int, int, int, int]:
+        # component -- пикселы (x, y): множество кортежей или массив (k, 2) (см. ComponentStore.pixels)
+        if not isinstance(component, np.ndarray):
+            component = np.array(list(component), dtype=np.int32)
 
+        min_x, min_y = component.min(axis=0).tolist()
+        max_x, max_y = component.max(axis=0).tolist()
         return min_x, min_y, max_x, max_y
 
     @staticmethod
-    def find_rect(component: Iterable[Tuple[int, int]]) -> Rect:
+    def find_rect(component: Union[Iterable[Tuple[int, int]], np.ndarray]) -> Rect:
         min_x, min_y, max_x, max_y = Segmentator.find_borders(component)
         return Rect(Point(min_x, min_y), Point(max_x, max_y))
 
+    @staticmethod
+    def find_components(img: np.ndarray, sensitivity: int = 1) -> List[Rect]:
+        # прямоугольники, описанные вокруг компонент связности графа закрашенных пикселов, где смежны пикселы из
+        # окрестности get_pixel_area(..., sensitivity); граф явно не строится, компоненты размечаются на массиве
+        return [Rect(Point(min_x, min_y), Point(max_x, max_y))
+                for min_x, min_y, max_x, max_y in find_components_borders(img, sensitivity).tolist()]
+
     @staticmethod
     def parse_image(img: np.ndarray, sensitivity: int = 1, **params) -> List[TextBlock]:
         # данный метод качественно находит все отдельные компоненты связности img: 1, если пиксел закрашен,
         # иначе 0 sensitivity -- чувствительность к компонентам: какого кол-ва пустого места достаточно,
         # чтобы пикселы не считались смежными
-        h, w = img.shape
-
-        adj_lists: Dict[Tuple[int, int], List[Tuple[int, int]]] = {
-            (_x, _y):
-                [(nx, ny) for nx, ny in Segmentator.get_pixel_area(_x, _y, w, h) if img[ny, nx]]
-            for _y, _x in product(range(h), range(w))
-                if img[_y, _x]
-        }  # adj_lists[i] -- список -- позиции закрашенных пикселов, которые смежны с закрашенным пикселом i
-
-        components_pointed: List[Set[Tuple[int, int]]] = get_connect_components(adj_lists)
-
-        zones = [Segmentator.find_rect(component) for component in components_pointed]
+        zones = Segmentator.find_components(img)
         zones = Segmentator._unite_components(zones, sensitivity, img, params)  # объединенные компоненты связности
 
         res = []
@@ -68,12 +65,8 @@ class Segmentator:
 
     @staticmethod
     def _unite_components(zones: List[Rect], sensitivity: float, doc: np.ndarray, params: Optional[Dict]) -> List[Rect]:
-        analyzer = SegAnalyzer(doc, params)
-
-        def check_unite_rects(a: Rect, b: Rect, dist: float) -> bool:
-            return analyzer.unite_segments(a, b, sensitivity, dist)
-
-        return postprocess_segmentation(zones, check_unite_rects, max(params.values()))
+        # для объединения нужен только геометрический критерий, анализ строк документа не требуется
+        return postprocess_segmentation(zones, UnitePolicy(sensitivity), max(params.values()))
 
     @staticmethod
     def parse_image_trivial(img: np.ndarray, **params) -> List[TextBlock]:
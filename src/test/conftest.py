@@ -0,0 +1,12 @@
+import os
+import sys
+
+# модули проекта импортируются от src, а часть из них -- еще и по короткому имени из своей папки
+# (from SegAnalyzer import ...), как при запуске скриптов из этих папок; WordSegmentation идет раньше
+# image_preprocessing, потому что в image_preprocessing лежат устаревшие модули с теми же именами
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in reversed([SRC_DIR,
+                      os.path.join(SRC_DIR, 'image_preprocessing', 'WordSegmentation'),
+                      os.path.join(SRC_DIR, 'image_preprocessing')]):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,18 @@
+import random
+
+from utils.geometry import Rect, Point, RectArray
+
+
+def _rects(rng: random.Random, n: int):
+    return [Rect(Point(rng.randint(0, 50), rng.randint(0, 50)), Point(rng.randint(50, 99), rng.randint(50, 99)))
+            for _ in range(n)]
+
+
+def test_rect_array_union_matches_rect():
+    rng = random.Random(0)
+    a, b, c = _rects(rng, 7), _rects(rng, 4), _rects(rng, 7)
+    ra, rb, rc = RectArray.from_rects(a), RectArray.from_rects(b), RectArray.from_rects(c)
+
+    assert ra.union(b[0]).to_rects() == [x.union(b[0]) for x in a]
+    assert ra.union(rc, outer=False).to_rects() == [x.union(y) for x, y in zip(a, c)]
+    assert ra.union(rb).to_rects() == [x.union(y) for x in a for y in b]
@@ -0,0 +1,53 @@
+import random
+from typing import *
+
+import pytest
+from image_preprocessing.WordSegmentation.SegAnalyzer import SegAnalyzer, DEFAULT_PARAMS, MIN_WORDS_DIST
+from utils.geometry import Rect, Point
+
+
+def _unite_pseudo_words_by_passes(words: List[Rect], params: Dict) -> None:
+    # исходный цикл SegAnalyzer._unite_pseudo_words: полные проходы, пока что-то меняется
+    while True:
+        changed = False
+        i = 0
+        while i < len(words):
+            j = i + 1
+            while j < len(words):
+                ti, tj = words[i], words[j]
+                if SegAnalyzer.unite_segments(ti, tj, params[MIN_WORDS_DIST], dist=Rect.distance(ti, tj)):
+                    words[i] = words[i].union(words[j])
+                    words.pop(j)
+                    changed = True
+                else:
+                    j += 1
+            i += 1
+
+        if not changed:
+            return
+
+
+def test_unite_words_keeps_merge_order():
+    # точка (46, 47) не присоединяется к слову, пока оно не выросло до (0, 45): порядок объединений важен
+    words = [(0, 2), (4, 7), (9, 16), (17, 24), (28, 29), (30, 35), (36, 45), (46, 47)]
+    SegAnalyzer._unite_words(words, DEFAULT_PARAMS, 5)
+    assert words == [(0, 45), (46, 47)]
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_unite_words_matches_passes(seed: int):
+    rng = random.Random(seed)
+    for _ in range(50):
+        params = dict(DEFAULT_PARAMS, **{MIN_WORDS_DIST: rng.randint(2, 8)})
+        x, words = 0, []
+        for _ in range(rng.randint(1, 25)):
+            x += rng.randint(1, 6)
+            r = x + rng.randint(0, 10)
+            words.append((x, r))
+            x = r
+        h = rng.randint(3, 30)
+
+        expected = [Rect(Point(l, 0), Point(r, h)) for l, r in words]
+        _unite_pseudo_words_by_passes(expected, params)
+        SegAnalyzer._unite_words(words, params, h)
+        assert words == [(r.left(), r.right()) for r in expected]
@@ -0,0 +1,30 @@
+import os
+
+import numpy as np
+import pytest
+from image_preprocessing.PicHandler import PicHandler
+from image_preprocessing.WordSegmentation.Segmentator import Segmentator
+from image_preprocessing.WordSegmentation.SegAnalyzer import DEFAULT_PARAMS
+from utils.labeling import find_components_borders
+from utils.RLEPage import RLEPage
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _page(name: str) -> np.ndarray:
+    ph = PicHandler(os.path.join(TEST_DIR, name))
+    ph.apply_adaptive_bin_filter(w=0.15)
+    return (ph.img < 220).astype(np.uint8)
+
+
+@pytest.mark.parametrize('page', ['hand1.jpg', 'test1.png'])
+@pytest.mark.parametrize('sensitivity', [1, 3, 8])
+def test_rle_page_matches_dense(page: str, sensitivity: int):
+    # postprocess_segmentation зависит от порядка компонент, поэтому совпадать должен и он
+    img = _page(page)
+    rle = RLEPage.from_dense(img)
+    assert np.array_equal(find_components_borders(img, sensitivity), find_components_borders(rle, sensitivity))
+
+    dense_zones = [tb.zone for tb in Segmentator.parse_image(img, sensitivity=sensitivity, **DEFAULT_PARAMS)]
+    rle_zones = [tb.zone for tb in Segmentator.parse_image(rle, sensitivity=sensitivity, **DEFAULT_PARAMS)]
+    assert dense_zones == rle_zones
@@ -0,0 +1,25 @@
+from image_preprocessing.WordSegmentation.SegAnalyzer import UnitePolicy
+from utils.algs import postprocess_segmentation
+from utils.geometry import Rect, Point
+from utils.spatial import RectGrid, DENSE_INDEX_MAX_SIZE
+
+# перевернутая зона (left > right, top > bottom), как у SegAnalyzer.trivial_parse на test/hand1.jpg
+INVERTED = Rect(Point(3264, 1196), Point(0, 0))
+
+
+def test_grid_finds_inverted_rect():
+    grid = RectGrid(16, [INVERTED, Rect(Point(100, 100), Point(110, 120))])
+    assert grid.query(Rect(Point(100, 100), Point(110, 120)), 1) == {0, 1}
+    assert grid.query(INVERTED, 1) == {0, 1}
+
+    grid.remove(0)
+    assert not any(0 in ids for ids in grid.cells.values())
+
+
+def test_inverted_copies_merge_on_grid_path():
+    # объектов больше DENSE_INDEX_MAX_SIZE: пары-кандидаты ищутся через сетку, копии должны найти друг друга
+    rects = [Rect(Point(40 * i, 3000), Point(40 * i + 10, 3010)) for i in range(DENSE_INDEX_MAX_SIZE + 1)]
+    rects += [INVERTED] * 10
+    res = postprocess_segmentation(rects, UnitePolicy(8), 15)
+    assert sum(r.left() > r.right() for r in res) == 1
+    assert len(res) == DENSE_INDEX_MAX_SIZE + 2
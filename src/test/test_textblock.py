@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+from utils.BitPage import BitPage
+from utils.geometry import Rect, Point
+from utils.TextBlock import TextBlock
+
+ZONE = Rect(Point(0, 0), Point(3, 2))
+
+
+@pytest.mark.parametrize('cont', [BitPage((3, 4), np.packbits(np.ones((3, 4), dtype=np.uint8), axis=1)),
+                                  lambda: np.ones((3, 4), dtype=np.uint8)])
+def test_lazy_contents_are_read_only(cont):
+    # содержимое строится заново при каждом обращении: запись в него должна падать, а не теряться
+    tb = TextBlock(ZONE, cont)
+    assert tb.contents.sum() == 12
+    with pytest.raises(ValueError):
+        tb.contents[0, 0] = 0
+
+
+def test_dense_contents_stay_writable():
+    tb = TextBlock(ZONE, np.ones((3, 4), dtype=np.uint8))
+    tb.contents[0, 0] = 0
+    assert tb.contents[0, 0] == 0
@@ -0,0 +1,35 @@
+import os
+from typing import *
+
+import pytest
+from image_preprocessing.PicHandler import PicHandler
+from image_preprocessing.Pipeline import Pipeline
+from image_preprocessing.WordSegmentation.WordParser import WordParser
+from image_preprocessing.WordSegmentation.FastSegmentation.FastSegmentator import FastSegmentator, DEFAULT_MODE, \
+    FAST_MODE
+from utils.geometry import RectArray
+from utils.tiling import tile_side, split_into_tiles
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+MEMORY_BUDGET = 16 << 20  # фрагменты 256 x 256 при перекрытии 128: на каждой странице их несколько
+OVERLAP = 128
+
+
+def _boxes(blocks: List) -> Set[Tuple[int, int, int, int]]:
+    return set(map(tuple, RectArray.from_text_blocks(blocks).coords.tolist()))
+
+
+# на этих страницах все объекты меньше перекрытия фрагментов, поэтому сегментация по фрагментам точная
+@pytest.mark.parametrize('page', ['test1.png', 'test2.png', 'test3.png', 'test4.png', 'hand1.jpg'])
+@pytest.mark.parametrize('mode', [DEFAULT_MODE, FAST_MODE])
+def test_parse_tiled_matches_parse(page: str, mode: int):
+    ph = PicHandler(os.path.join(TEST_DIR, page))
+    pipeline = Pipeline([('apply_adaptive_bin_filter', {'w': 0.15})])
+    assert len(split_into_tiles(ph.get_image().shape, tile_side(MEMORY_BUDGET, OVERLAP), OVERLAP)) > 1
+
+    full = WordParser.parse(FastSegmentator.parse, ph.exec_pipeline(pipeline, make_copy=True), rescale_k=1,
+                            sens=5, MAX_LOCAL_SCOPE=10, PARSING_MODE=mode)
+    tiled = WordParser.parse_tiled(FastSegmentator.parse, ph, pipeline, MEMORY_BUDGET, OVERLAP,
+                                   sens=5, MAX_LOCAL_SCOPE=10, PARSING_MODE=mode)
+    assert _boxes(tiled) == _boxes(full)
+    assert len(tiled) == len(full)
@@ -0,0 +1,99 @@
+from __future__ import annotations
+from typing import *
+import numpy as np
+
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)  # число единиц в байте
+
+
+class BitPage:
+    """
+    Бинарное изображение, упакованное по 8 пикселов в байт (np.packbits по строкам): 1 бит -- закрашенный пиксел.
+    Занимает в 8 раз меньше памяти, чем матрица uint8; суммы по строкам, столбцам и прямоугольникам считаются
+    по упакованным байтам, плотная матрица восстанавливается только по запросу (to_dense).
+    img[y0: y1, x0: x1] -- фрагмент в том же формате
+    """
+
+    shape: Tuple[int, int]  # (h, w), как у плотной матрицы
+    bits: np.ndarray  # uint8 (h, ceil(w / 8)); лишние биты последнего байта строки -- нули
+
+    def __init__(self, shape: Tuple[int, int], bits: np.ndarray):
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.bits = bits
+
+    @staticmethod
+    def from_dense(img: np.ndarray) -> BitPage:
+        # img: 1 (или любое ненулевое значение), если пиксел закрашен, иначе 0
+        return BitPage(img.shape, np.packbits(img != 0, axis=1))
+
+    def to_dense(self) -> np.ndarray:
+        # плотная матрица uint8: 1, если пиксел закрашен, иначе 0
+        return np.unpackbits(self.bits, axis=1, count=self.shape[1])
+
+    @property
+    def nbytes(self) -> int:
+        return self.bits.nbytes
+
+    def sum(self) -> int:
+        # количество закрашенных пикселов
+        return int(_POPCOUNT[self.bits].sum(dtype=np.int64))
+
+    def __getitem__(self, item: Tuple[slice, slice]) -> BitPage:
+        # фрагмент [y0: y1, x0: x1] (срезы с шагом 1, как у плотной матрицы); распаковывается только сам фрагмент
+        ys, xs = item
+        h, w = self.shape
+        y0, y1, _ = ys.indices(h)
+        x0, x1, _ = xs.indices(w)
+        y1, x1 = max(y0, y1), max(x0, x1)
+
+        if x0 % 8 == 0 and (x1 % 8 == 0 or x1 == w):
+            # границы фрагмента совпадают с границами байтов
+            return BitPage((y1 - y0, x1 - x0), self.bits[y0: y1, x0 // 8: (x1 + 7) // 8].copy())
+        return BitPage.from_dense(self._unpack(y0, y1, x0, x1))
+
+    def _unpack(self, y0: int, y1: int, x0: int, x1: int) -> np.ndarray:
+        # плотная матрица фрагмента [y0: y1, x0: x1] (границы уже должны лежать внутри изображения)
+        b0 = x0 // 8
+        block = np.unpackbits(self.bits[y0: y1, b0: (x1 + 7) // 8], axis=1)
+        return block[:, x0 - 8 * b0: x1 - 8 * b0]
+
+    def row_sums(self) -> np.ndarray:
+        # количество закрашенных пикселов в каждой строке
+        return _POPCOUNT[self.bits].sum(axis=1, dtype=np.int64)
+
+    def band_col_sums(self, tops: np.ndarray, bots: np.ndarray) -> np.ndarray:
+        # матрица (len(tops), w): i-я строка -- суммы по столбцам для строк [tops[i], bots[i])
+        res = np.zeros((len(tops), self.shape[1]), dtype=np.int64)
+        for i, (top, bot) in enumerate(zip(np.asarray(tops).tolist(), np.asarray(bots).tolist())):
+            res[i] = self._col_sums(top, bot)
+        return res
+
+    def _col_sums(self, top: int, bot: int) -> np.ndarray:
+        # суммы по столбцам для строк [top, bot): для каждой битовой плоскости (позиции пиксела в байте)
+        # складываются байты, затем плоскости чередуются в порядке столбцов
+        w = self.shape[1]
+        rows = self.bits[top: bot]
+        planes = np.empty((rows.shape[1], 8), dtype=np.int64)
+        for b in range(8):
+            planes[:, b] = ((rows >> (7 - b)) & 1).sum(axis=0, dtype=np.int64)
+        return planes.reshape((-1,))[:w]
+
+    def col_sums(self) -> np.ndarray:
+        # количество закрашенных пикселов в каждом столбце
+        return self._col_sums(0, self.shape[0])
+
+    def rect_sum(self, y0: int, y1: int, x0: int, x1: int) -> int:
+        # количество закрашенных пикселов в [y0: y1, x0: x1] (границы уже должны лежать внутри изображения)
+        if y1 <= y0 or x1 <= x0:
+            return 0
+        b0, b1 = x0 // 8, (x1 + 7) // 8
+        block = self.bits[y0: y1, b0: b1]
+        total = int(_POPCOUNT[block].sum(dtype=np.int64))
+
+        # вычитаем пикселы первого и последнего байтов, лежащие вне [x0, x1)
+        head = 8 * b0 - x0 + 8  # сколько пикселов первого байта лежит внутри
+        if head < 8:
+            total -= int(_POPCOUNT[block[:, 0] & ~np.uint8((1 << head) - 1)].sum(dtype=np.int64))
+        tail = x1 - 8 * (b1 - 1)  # сколько пикселов последнего байта лежит внутри
+        if tail < 8:
+            total -= int(_POPCOUNT[block[:, -1] & np.uint8((1 << (8 - tail)) - 1)].sum(dtype=np.int64))
+        return total
@@ -0,0 +1,120 @@
+from __future__ import annotations
+from typing import *
+import numpy as np
+from utils.geometry import Rect, Point, RectArray
+
+
+class ComponentStore:
+    """
+    Компоненты связности (множества закрашенных пикселов) в сжатом построчном формате (CSR): координаты пикселов
+    всех компонент лежат подряд в двух массивах int32, пикселы компоненты i -- это xs[offsets[i]: offsets[i + 1]],
+    ys[offsets[i]: offsets[i + 1]]. На закрашенный пиксел приходится 8 байт вместо кортежа в множестве
+    """
+
+    xs: np.ndarray  # int32
+    ys: np.ndarray  # int32
+    offsets: np.ndarray  # int64, длина -- количество компонент + 1
+
+    def __init__(self, xs: np.ndarray, ys: np.ndarray, offsets: np.ndarray):
+        self.xs = np.asarray(xs, dtype=np.int32)
+        self.ys = np.asarray(ys, dtype=np.int32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @staticmethod
+    def from_labels(labels: np.ndarray, n: Optional[int] = None) -> ComponentStore:
+        # labels -- матрица меток (см. utils.labeling.label_components), 0 -- фон; n -- количество меток с фоном.
+        # Компонента i хранит пикселы метки i + 1 в порядке обхода изображения по строкам
+        ys, xs = np.nonzero(labels)
+        ls = labels[ys, xs]
+        if n is None:
+            n = int(ls.max()) + 1 if len(ls) else 1
+
+        order = np.argsort(ls, kind='stable')
+        offsets = np.zeros((n,), dtype=np.int64)
+        np.cumsum(np.bincount(ls, minlength=n)[1:], out=offsets[1:])
+        return ComponentStore(xs[order], ys[order], offsets)
+
+    @staticmethod
+    def from_pixel_sets(components: Iterable[Iterable[Tuple[int, int]]]) -> ComponentStore:
+        # из множеств пикселов (x, y), например, результата utils.algs.get_connect_components
+        parts = [np.array(list(component), dtype=np.int32).reshape((-1, 2)) for component in components]
+        offsets = np.zeros((len(parts) + 1,), dtype=np.int64)
+        np.cumsum([len(p) for p in parts], out=offsets[1:])
+        pixels = np.concatenate(parts) if parts else np.zeros((0, 2), dtype=np.int32)
+        return ComponentStore(pixels[:, 0], pixels[:, 1], offsets)
+
+    def to_pixel_sets(self) -> List[Set[Tuple[int, int]]]:
+        return [set(zip(xs.tolist(), ys.tolist())) for xs, ys in (self[i] for i in range(len(self)))]
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> Tuple[np.ndarray, np.ndarray]:
+        # координаты x и y пикселов компоненты i (без копирования)
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        return self.xs[start: stop], self.ys[start: stop]
+
+    def pixels(self, i: int) -> np.ndarray:
+        # пикселы компоненты i -- массив (k, 2) строк (x, y)
+        xs, ys = self[i]
+        return np.stack([xs, ys], axis=1)
+
+    @property
+    def nbytes(self) -> int:
+        return self.xs.nbytes + self.ys.nbytes + self.offsets.nbytes
+
+    def sizes(self) -> np.ndarray:
+        # количество пикселов в каждой компоненте
+        return np.diff(self.offsets)
+
+    def borders(self) -> np.ndarray:
+        # массив (n, 4) строк (min_x, min_y, max_x, max_y), как у Segmentator.find_borders; у пустых компонент -- нули
+        res = np.zeros((len(self), 4), dtype=np.int32)
+        nonempty = self.sizes() > 0
+        if not nonempty.any():
+            return res
+
+        starts = self.offsets[:-1][nonempty]
+        for column, (values, reduce) in enumerate(((self.xs, np.minimum), (self.ys, np.minimum),
+                                                   (self.xs, np.maximum), (self.ys, np.maximum))):
+            res[nonempty, column] = reduce.reduceat(values, starts)
+
+        return res
+
+    def rects(self) -> RectArray:
+        return RectArray(self.borders())
+
+    def centroids(self) -> np.ndarray:
+        # массив (n, 2) центров масс (x, y) компонент; у пустых компонент -- nan
+        res = np.full((len(self), 2), np.nan)
+        sizes = self.sizes()
+        nonempty = sizes > 0
+        if not nonempty.any():
+            return res
+
+        starts = self.offsets[:-1][nonempty]
+        res[nonempty, 0] = np.add.reduceat(self.xs.astype(np.int64), starts) / sizes[nonempty]
+        res[nonempty, 1] = np.add.reduceat(self.ys.astype(np.int64), starts) / sizes[nonempty]
+        return res
+
+    def render(self, i: int, rect: Optional[Rect] = None) -> np.ndarray:
+        # изображение компоненты i внутри rect (по умолчанию -- описанного прямоугольника): 1, если пиксел закрашен,
+        # иначе 0; пикселы вне rect отбрасываются
+        xs, ys = self[i]
+        if rect is None:
+            if not len(xs):
+                return np.zeros((0, 0), dtype=np.uint8)
+            rect = Rect(Point(int(xs.min()), int(ys.min())), Point(int(xs.max()), int(ys.max())))
+
+        w, h = rect.shape()
+        res = np.zeros((h + 1, w + 1), dtype=np.uint8)
+        xs, ys = xs - rect.left(), ys - rect.top()
+        inside = (xs >= 0) & (xs <= w) & (ys >= 0) & (ys <= h)
+        res[ys[inside], xs[inside]] = 1
+        return res
+
+    def render_labels(self, shape: Tuple[int, int]) -> np.ndarray:
+        # матрица меток формы shape (h, w): пикселы компоненты i помечены i + 1, фон -- 0
+        res = np.zeros(shape, dtype=np.int32)
+        res[self.ys, self.xs] = np.repeat(np.arange(1, len(self) + 1, dtype=np.int32), self.sizes())
+        return res
@@ -0,0 +1,158 @@
+from __future__ import annotations
+from typing import *
+import numpy as np
+from utils.algs import DisjointSet
+
+
+class RLEPage:
+    """
+    Бинарная страница, закодированная построчными сериями закрашенных пикселов (run-length encoding): серия r --
+    пикселы [starts[r], ends[r]) строки rows[r]; серии упорядочены по строкам, внутри строки -- слева направо.
+    Суммы по строкам, столбцам и прямоугольникам, разметка компонент и вырезание фрагментов требуют времени,
+    пропорционального числу серий, а не площади страницы; img[y0: y1, x0: x1] -- фрагмент в том же формате
+    """
+
+    shape: Tuple[int, int]  # (h, w), как у плотной матрицы
+    rows: np.ndarray  # int32
+    starts: np.ndarray  # int32
+    ends: np.ndarray  # int32, конец серии не включается
+    row_offsets: np.ndarray  # int64 (h + 1,): серии строки y -- [row_offsets[y], row_offsets[y + 1])
+
+    def __init__(self, shape: Tuple[int, int], rows: np.ndarray, starts: np.ndarray, ends: np.ndarray):
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.rows = np.asarray(rows, dtype=np.int32)
+        self.starts = np.asarray(starts, dtype=np.int32)
+        self.ends = np.asarray(ends, dtype=np.int32)
+        self.row_offsets = np.zeros((self.shape[0] + 1,), dtype=np.int64)
+        np.cumsum(np.bincount(self.rows, minlength=self.shape[0]), out=self.row_offsets[1:])
+
+    @staticmethod
+    def from_dense(img: np.ndarray) -> RLEPage:
+        # img: 1 (или любое ненулевое значение), если пиксел закрашен, иначе 0
+        h, w = img.shape
+        edges = np.diff((img != 0).astype(np.int8), axis=1, prepend=0, append=0)
+        rows, starts = np.nonzero(edges == 1)
+        ends = np.nonzero(edges == -1)[1]  # в каждой строке концов столько же, сколько начал, и в том же порядке
+        return RLEPage((h, w), rows, starts, ends)
+
+    def to_dense(self) -> np.ndarray:
+        # плотная матрица uint8: 1, если пиксел закрашен, иначе 0
+        h, w = self.shape
+        diff = np.zeros((h, w + 1), dtype=np.int8)
+        np.add.at(diff, (self.rows, self.starts), 1)
+        np.add.at(diff, (self.rows, self.ends), -1)
+        return np.cumsum(diff[:, :w], axis=1, dtype=np.int8).astype(np.uint8)
+
+    def __len__(self) -> int:
+        # количество серий
+        return len(self.rows)
+
+    def lengths(self) -> np.ndarray:
+        return (self.ends - self.starts).astype(np.int64)
+
+    def sum(self) -> int:
+        # количество закрашенных пикселов
+        return int(self.lengths().sum())
+
+    def __getitem__(self, item: Tuple[slice, slice]) -> RLEPage:
+        # фрагмент [y0: y1, x0: x1] страницы (срезы с шагом 1, как у плотной матрицы)
+        ys, xs = item
+        h, w = self.shape
+        y0, y1, _ = ys.indices(h)
+        x0, x1, _ = xs.indices(w)
+        y1, x1 = max(y0, y1), max(x0, x1)
+
+        first, last = self.row_offsets[y0], self.row_offsets[y1]
+        starts = np.maximum(self.starts[first: last], x0)
+        ends = np.minimum(self.ends[first: last], x1)
+        keep = starts < ends
+        return RLEPage((y1 - y0, x1 - x0), self.rows[first: last][keep] - y0, starts[keep] - x0, ends[keep] - x0)
+
+    def row_sums(self) -> np.ndarray:
+        # количество закрашенных пикселов в каждой строке
+        return np.bincount(self.rows, weights=self.lengths(), minlength=self.shape[0]).astype(np.int64)
+
+    def band_col_sums(self, tops: np.ndarray, bots: np.ndarray) -> np.ndarray:
+        # матрица (len(tops), w): i-я строка -- суммы по столбцам для строк [tops[i], bots[i])
+        h, w = self.shape
+        tops, bots = np.asarray(tops, dtype=np.int64), np.asarray(bots, dtype=np.int64)
+        firsts, lasts = self.row_offsets[tops], self.row_offsets[np.maximum(tops, bots)]
+        counts = lasts - firsts
+
+        # номера серий всех полос подряд и номер полосы для каждой из них
+        band = np.repeat(np.arange(len(tops)), counts)
+        runs = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(firsts, counts)
+
+        # разностный массив: +1 в начале серии, -1 после ее конца
+        width = w + 1
+        diff = np.bincount(band * width + self.starts[runs], minlength=len(tops) * width) - \
+            np.bincount(band * width + self.ends[runs], minlength=len(tops) * width)
+        return np.cumsum(diff.reshape((len(tops), width))[:, :w], axis=1)
+
+    def col_sums(self) -> np.ndarray:
+        # количество закрашенных пикселов в каждом столбце
+        return self.band_col_sums(np.array([0]), np.array([self.shape[0]]))[0]
+
+    def rect_sum(self, y0: int, y1: int, x0: int, x1: int) -> int:
+        # количество закрашенных пикселов в [y0: y1, x0: x1] (границы уже должны лежать внутри страницы)
+        if y1 <= y0 or x1 <= x0:
+            return 0
+        first, last = self.row_offsets[y0], self.row_offsets[y1]
+        overlap = np.minimum(self.ends[first: last], x1) - np.maximum(self.starts[first: last], x0)
+        return int(overlap[overlap > 0].sum())
+
+    def _touching_runs(self, sensitivity: int) -> Tuple[np.ndarray, np.ndarray]:
+        # пары серий, пикселы которых смежны: max(|dx|, |dy|) <= sensitivity для каких-то двух их пикселов
+        k = sensitivity
+        w = self.shape[1]
+        span = w + 2 * k + 2  # ключи серий разных строк не пересекаются
+        start_keys = self.rows.astype(np.int64) * span + self.starts + k
+        end_keys = self.rows.astype(np.int64) * span + self.ends + k
+        n = len(self)
+
+        firsts, seconds = [], []
+        for dy in range(k + 1):
+            # серия b строки rows[a] + dy смежна с серией a, если b.end - 1 >= a.start - k и b.start <= a.end - 1 + k
+            # (в той же строке рассматриваются только серии правее a)
+            base = (self.rows.astype(np.int64) + dy) * span + k
+            if dy:
+                lo = np.searchsorted(end_keys, base + self.starts - k + 1, side='left')
+            else:
+                lo = np.arange(1, n + 1)
+            hi = np.searchsorted(start_keys, base + self.ends - 1 + k, side='right')
+            counts = np.maximum(hi - lo, 0)
+            firsts.append(np.repeat(np.arange(n), counts))
+            seconds.append(np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) +
+                           np.repeat(lo, counts))
+
+        return np.concatenate(firsts), np.concatenate(seconds)
+
+    def label_runs(self, sensitivity: int = 1) -> Tuple[int, np.ndarray]:
+        """
+        Разметка компонент связности по сериям (аналог utils.labeling.label_components)
+
+        :param sensitivity: радиус окрестности: пикселы смежны, если max(|dx|, |dy|) <= sensitivity
+        :return: количество компонент (без фона) и номер компоненты каждой серии; компоненты пронумерованы в
+        порядке обхода страницы по строкам
+        """
+
+        ds = DisjointSet(len(self))
+        ds.union_pairs(zip(*(a.tolist() for a in self._touching_runs(max(1, int(sensitivity))))))
+        _, first_run, labels = np.unique(np.array(ds.roots(), dtype=np.int64), return_index=True,
+                                         return_inverse=True)
+        # np.unique нумерует корни по возрастанию, а не по первой серии компоненты
+        order = np.argsort(np.argsort(first_run))
+        return len(first_run), order[labels].reshape((-1,))
+
+    def components_borders(self, sensitivity: int = 1) -> np.ndarray:
+        # массив (n, 4) строк (min_x, min_y, max_x, max_y) компонент связности в том же порядке, что и у
+        # utils.labeling.find_components_borders (по первой серии компоненты)
+        n, labels = self.label_runs(sensitivity)
+        res = np.empty((n, 4), dtype=np.int32)
+        res[:, :2] = np.iinfo(np.int32).max
+        res[:, 2:] = -1
+        np.minimum.at(res[:, 0], labels, self.starts)
+        np.minimum.at(res[:, 1], labels, self.rows)
+        np.maximum.at(res[:, 2], labels, self.ends - 1)
+        np.maximum.at(res[:, 3], labels, self.rows)
+        return res
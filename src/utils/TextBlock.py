@@ -1,4 +1,6 @@
+from typing import *
 from utils.geometry import Rect
+from utils.BitPage import BitPage
 import numpy as np
 from image_preprocessing.PicHandler import view_image
 from image_preprocessing.PicHandler import PicHandler
@@ -6,11 +8,37 @@ from image_preprocessing.PicHandler import PicHandler
 
 class TextBlock:
     zone: Rect  # расположение данного слова (слитного сочетания символов) на изображении
-    contents: np.ndarray  # содержимое блока -- фрагмент изображения внутри zone: 1, если пиксел закрашен, иначе 0
+    # contents: содержимое блока -- фрагмент изображения внутри zone: 1, если пиксел закрашен, иначе 0
+    packed: Optional[BitPage]  # содержимое в упакованном виде, если блок был создан из BitPage
 
-    def __init__(self, zone: Rect, cont: np.ndarray):
+    def __init__(self, zone: Rect, cont: Union[np.ndarray, BitPage, Callable[[], np.ndarray]]):
         self.zone = zone
         self.contents = cont
 
+    @property
+    def contents(self) -> np.ndarray:
+        # упакованное или заданное функцией содержимое получается при каждом обращении и не хранится, поэтому
+        # возвращается только для чтения: запись в такую копию (tb.contents[y, x] = 0) потерялась бы, а так она
+        # вызывает ошибку; изменять содержимое нужно через tb.contents = ...
+        if self.packed is not None:
+            res = self.packed.to_dense()
+        elif self._source is not None:
+            res = self._source()
+        else:
+            return self._contents
+
+        res.flags.writeable = False
+        return res
+
+    @contents.setter
+    def contents(self, cont: Union[np.ndarray, BitPage, Callable[[], np.ndarray]]) -> None:
+        self.packed, self._source, self._contents = None, None, None
+        if isinstance(cont, BitPage):
+            self.packed = cont
+        elif callable(cont):
+            self._source = cont
+        else:
+            self._contents = cont
+
     def view(self) -> None:
         view_image(PicHandler.from_zero_one(self.contents), "TextBlock: %s" % str(self.zone))
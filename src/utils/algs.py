@@ -1,9 +1,95 @@
-from collections import deque
 from utils.geometry import Rect
+from utils.spatial import make_distance_index, PairDistanceIndex
 from typing import *
+import heapq
 import numpy as np
 
 
+class DisjointSet:
+    """
+    Система непересекающихся множеств над элементами 0..n-1: массивы предков и рангов, сжатие путей
+    и объединение по рангу; общая для сегментаторов и инструментов доразметки выборки
+    """
+
+    parent: List[int]  # parent[i] -- предок i; i -- корень своего множества, если parent[i] == i
+    rank: List[int]  # верхняя оценка высоты дерева с корнем i
+    n_sets: int  # текущее количество множеств
+
+    def __init__(self, n: int = 0):
+        self.parent = list(range(n))
+        self.rank = [0] * n
+        self.n_sets = n
+
+    def __len__(self) -> int:
+        return len(self.parent)
+
+    def add(self) -> int:
+        # добавляет новый элемент в отдельном множестве и возвращает его номер
+        i = len(self.parent)
+        self.parent.append(i)
+        self.rank.append(0)
+        self.n_sets += 1
+        return i
+
+    def find(self, x: int) -> int:
+        parent = self.parent
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+
+        while parent[x] != root:  # сжатие пути: все вершины пути подвешиваем к корню
+            parent[x], x = root, parent[x]
+
+        return root
+
+    def union(self, a: int, b: int) -> bool:
+        # объединяет множества, содержащие a и b; False, если они уже были в одном множестве
+        ra, rb = self.find(a), self.find(b)
+        if ra == rb:
+            return False
+
+        rank = self.rank
+        if rank[ra] < rank[rb]:
+            ra, rb = rb, ra
+        self.parent[rb] = ra
+        if rank[ra] == rank[rb]:
+            rank[ra] += 1
+
+        self.n_sets -= 1
+        return True
+
+    def union_pairs(self, pairs: Iterable[Tuple[int, int]]) -> int:
+        # объединяет множества для каждой пары; возвращает количество фактически выполненных объединений
+        union = self.union
+        return sum(union(int(a), int(b)) for a, b in pairs)
+
+    def connected(self, a: int, b: int) -> bool:
+        return self.find(a) == self.find(b)
+
+    def roots(self) -> List[int]:
+        # roots()[i] -- представитель множества, содержащего i
+        find = self.find
+        return [find(i) for i in range(len(self.parent))]
+
+    def groups(self) -> List[List[int]]:
+        # все множества; множества упорядочены по наименьшему элементу, элементы -- по возрастанию
+        groups: Dict[int, List[int]] = {}
+        for i, root in enumerate(self.roots()):
+            groups.setdefault(root, []).append(i)
+
+        return list(groups.values())
+
+
+def build_integral(img: np.ndarray, dtype: type = np.int64) -> np.ndarray:
+    # таблица сумм по прямоугольникам (integral image) с нулевыми первой строкой и первым столбцом; сумма по
+    # img[y0: y1, x0: x1] -- integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+    h, w = img.shape
+    integral = np.zeros((h + 1, w + 1), dtype=dtype)
+    np.cumsum(img, axis=0, dtype=dtype, out=integral[1:, 1:])
+    np.cumsum(integral[1:, 1:], axis=1, out=integral[1:, 1:])
+    return integral
+
+
 def get_connect_components(adj_lists: Dict[Any, List[Any]]) -> List[Set[Any]]:
     """
     Имеем списки смежности, помещенные в словарь; ключ -- вершина, значение -- список смежных с ней вершин
@@ -13,64 +99,38 @@ def get_connect_components(adj_lists: Dict[Any, List[Any]]) -> List[Set[Any]]:
     :return: список компонент связности в графе
     """
 
-    visited = set()
-    comps = []
+    vertices = list(adj_lists.keys())
+    index = {v: i for i, v in enumerate(vertices)}
+    ds = DisjointSet(len(vertices))
 
-    for v in adj_lists.keys():
-        if v in visited:
-            continue
-        new_comp = {v}
-        visited.add(v)
-        should_visit = deque(adj_lists[v])
-        while len(should_visit):  # обойдем все смежные с v вершины
-            u = should_visit.popleft()
-            new_comp.add(u)
-            visited.add(u)
-            for t in adj_lists[u]:
-                if t not in visited and t not in should_visit:
-                    # мы еще не заходили в t ни при обходе компоненты, ни до этого
-                    should_visit.append(t)
+    for v, neighbours in adj_lists.items():
+        i = index[v]
+        for u in neighbours:
+            j = index.get(u)
+            if j is None:
+                # вершина встречается только в списках смежности
+                j = index[u] = ds.add()
+                vertices.append(u)
+            ds.union(i, j)
 
-        comps.append(new_comp)
-
-    return comps
+    # компоненты упорядочены по первой вершине, как при обходе в порядке ключей словаря
+    return [{vertices[i] for i in group} for group in ds.groups()]
 
 
 def unite(components: List[Set[int]], to_unite: List[Tuple[int, int]]) -> List[Set[int]]:
-    def unite_sets(sets: Iterable[Set]) -> Set:
-        # объединяет все множества в наборе
-        ans = set()
-        for s in sets:
-            ans = ans.union(s)
-
-        return ans
-
-    adj_list = dict()
-
-    # для каждого номера компоненты определим все другие компоненты, с которыми мы будем ее объединять
-    for u1, u2 in to_unite:
-        for u in (u1, u2):
-            if u not in adj_list.keys():
-                adj_list[u] = []
-
-        if u2 not in adj_list[u1]:
-            adj_list[u1].append(u2)
-        if u1 not in adj_list[u2]:
-            adj_list[u2].append(u1)
+    ds = DisjointSet(len(components))
+    ds.union_pairs(to_unite)
 
-    supercomponents: List[Set[int]] = get_connect_components(adj_list)  # список множеств; каждое множество --
-    # номера компонент связности, которые нужно будет объединить между собой
-
-    const_comp = [i for i in range(len(components)) if i not in adj_list.keys()]
+    touched = dict.fromkeys(u for pair in to_unite for u in pair)  # номера компонент в порядке их упоминания
+    supercomponents: Dict[int, List[int]] = {}  # корень -> номера компонент связности, которые нужно объединить
+    for u in touched:
+        supercomponents.setdefault(ds.find(u), []).append(u)
 
+    # объединяем множества пикселов за один проход по всем множествам; прочие компоненты оставляем неизменными
     return [
-               unite_sets(
-                   components[i] for i in supercomponent
-               )
-               for supercomponent in supercomponents
-           ] + [components[j] for j in const_comp]
-    # наконец-то объединяем множества пикселов; индексы объединяемых множеств содержатся в supercomponents
-    # множества const_comp оставляем неизменными и просто добавляем в ответ
+               set().union(*(components[i] for i in supercomponent))
+               for supercomponent in supercomponents.values()
+           ] + [components[j] for j in range(len(components)) if j not in touched]
 
 
 def find_max_by_order(s: Set[Tuple[int, int]], axis: int, order_function: Callable[[int, int], bool]) -> int:
@@ -120,47 +180,174 @@ def find_max_by_order(s: Set[Tuple[int, int]], axis: int, order_function: Callab
     return results'''
 
 
+class MergeEngine:
+    """
+    Замыкание объединений объектов сегментации. Критерий вычисляется только для пар-кандидатов из индекса
+    (см. utils.spatial) и считается симметричным; положительные решения записываются в систему непересекающихся
+    множеств. Пара проверяется повторно, только если с момента прошлой проверки одна из ее групп выросла, поэтому
+    критерий вычисляется не более (число пар-кандидатов) * (число объединений + 1) раз, а результат совпадает
+    с повторением полных проходов до тех пор, пока что-то меняется.
+
+    Критерий зависит от того, в каком порядке растут группы (например, проверки пунктуации и диакритики
+    в SegAnalyzer.unite_segments), поэтому порядок проверок повторяет один из двух исходных циклов:
+    forward_only = False -- группа i сравнивается со всеми кандидатами, найденными в начале ее просмотра, в том числе
+    с меньшими номерами (как в postprocess_segmentation); forward_only = True -- только с кандидатами j > i
+    по возрастанию, после каждого объединения кандидаты ищутся заново с места j (как в цикле со списком и pop(j)).
+    В обоих случаях объединение получает номер i
+    """
+
+    items: List
+    criterion: Callable[[Any, Any, float], bool]
+    index: Any  # candidates(i), distance(i, j), merge(i, j, merged) -- см. utils.spatial
+    union_function: Callable[[Any, Any], Any]
+    forward_only: bool
+    disjoint_set: DisjointSet  # номера исходных объектов, вошедших в одну группу
+    n_evaluations: int  # сколько раз был вычислен критерий
+    n_merges: int
+
+    def __init__(self, items: List, criterion: Callable[[Any, Any, float], bool], index: Any,
+                 union_function: Callable[[Any, Any], Any] = None, forward_only: bool = False):
+        if union_function is None:
+            union_function = lambda a, b: a.union(b)
+
+        self.items = items
+        self.criterion = criterion
+        self.index = index
+        self.union_function = union_function
+        self.forward_only = forward_only
+        self.disjoint_set = DisjointSet(len(items))
+        self.n_evaluations = 0
+        self.n_merges = 0
+        self._version = [0] * len(items)  # сколько раз группа i выросла
+        self._checked: Dict[Tuple[int, int], Tuple[int, int]] = {}  # пара -> версии групп при отрицательной проверке
+
+    def _try_merge(self, i: int, j: int) -> bool:
+        # проверяет пару (i, j), если она изменилась с прошлой проверки, и при положительном решении присоединяет j к i
+        version, checked = self._version, self._checked
+        pair = (i, j) if i < j else (j, i)
+        stamp = version[pair[0]], version[pair[1]]
+        if checked.get(pair) == stamp:
+            return False
+
+        items = self.items
+        self.n_evaluations += 1
+        if not self.criterion(items[i], items[j], self.index.distance(i, j)):
+            checked[pair] = stamp
+            return False
+
+        items[i] = self.union_function(items[i], items[j])
+        items[j] = None
+        self.index.merge(i, j, items[i])
+        self.disjoint_set.union(i, j)
+        version[i] += 1
+        self.n_merges += 1
+        return True
+
+    def run(self) -> List:
+        # объединяет объекты items (список изменяется на месте: поглощенные объекты заменяются на None);
+        # возвращает оставшиеся объекты в порядке их номеров
+        if self.forward_only:
+            self._run_forward()
+        else:
+            self._run_all()
+        return [item for item in self.items if item is not None]
+
+    def _run_all(self) -> None:
+        items, index = self.items, self.index
+        pending = list(range(len(items)))
+        while pending:
+            # группы просматриваются в том же порядке, что и при полных проходах, но пропускаются пары,
+            # которые уже были проверены и с тех пор не менялись
+            heapq.heapify(pending)
+            in_pass = set(pending)
+            next_pass = set()
+            while pending:
+                i = heapq.heappop(pending)
+                if items[i] is None:
+                    continue
+
+                grown = False
+                for j in index.candidates(i):
+                    grown |= self._try_merge(i, j)
+
+                if grown:
+                    # соседей выросшей группы, идущих после нее, нужно пересмотреть на этом же проходе,
+                    # остальных -- на следующем
+                    next_pass.add(i)
+                    for k in index.candidates(i):
+                        if k > i and k not in in_pass:
+                            heapq.heappush(pending, k)
+                            in_pass.add(k)
+                        elif k < i:
+                            next_pass.add(k)
+
+            pending = list(next_pass)
+
+    def _run_forward(self) -> None:
+        # пары (i, j > i) меняются, только когда растет i или j, а группа растет только на своем шаге прохода;
+        # поэтому на следующем проходе достаточно просмотреть выросшие группы и их соседей с меньшими номерами
+        items, index = self.items, self.index
+        pending = range(len(items))
+        while pending:
+            next_pass = set()
+            for i in pending:
+                if items[i] is None:
+                    continue
+
+                pos, grown = i, False
+                candidates = index.candidates(i)
+                k = 0
+                while k < len(candidates):
+                    j = candidates[k]
+                    k += 1
+                    if j > pos and self._try_merge(i, j):
+                        # после объединения у i могли появиться новые соседи; просмотр продолжается после j
+                        pos, grown = j, True
+                        candidates, k = index.candidates(i), 0
+
+                if grown:
+                    next_pass.add(i)
+                    next_pass.update(k for k in index.candidates(i) if k < i)
+
+            pending = sorted(next_pass)
+
+    def groups(self) -> List[List[int]]:
+        # номера исходных объектов, вошедших в каждый из результатов run (в том же порядке)
+        return self.disjoint_set.groups()
+
+
 def postprocess_segmentation(results: List, criterion: Callable[[Any, Any, float], bool], local_scope_sens: float,
-                             union_function: Callable = None, distance_metric: Callable = None) -> List:
+                             union_function: Callable = None, distance_metric: Callable = None,
+                             bbox_function: Callable[[Any], Rect] = None,
+                             neighbours: Tuple[Iterable[Tuple[int, int]], Iterable[float]] = None) -> List:
+    """
+    Объединяет объекты сегментации (прямоугольники, контуры), пока критерий criterion разрешает объединять
+    какие-либо два из них; рассматриваются только пары в пределах local_scope_sens друг от друга
+
+    :param results: объекты сегментации
+    :param criterion: criterion(a, b, dist) -- следует ли объединить a и b, находящиеся на расстоянии dist
+    :param local_scope_sens: максимальное расстояние между объектами, которые имеет смысл сравнивать
+    :param union_function: объединение двух объектов; по умолчанию a.union(b)
+    :param distance_metric: расстояние между объектами; по умолчанию Rect.distance
+    :param bbox_function: описанный прямоугольник объекта для пространственного индекса (по умолчанию, если
+    distance_metric не задана, объекты сами являются прямоугольниками); без него используется полная матрица
+    расстояний
+    :param neighbours: заранее найденные пары близких объектов (номера в results) и расстояния между ними;
+    если заданы, distance_metric и bbox_function не используются
+    :return: список объединенных объектов
+    """
+
     if union_function is None:
         union_function = lambda a, b: a.union(b)
 
-    if distance_metric is None:
-        distance_metric = lambda a, b: Rect.distance(a, b)
-
-    actual_results = np.ones((len(results),), dtype=np.bool)
-    distances = np.zeros((len(results), len(results)))
-    for i in range(len(results)):
-        for j in range(i + 1, len(results)):
-            if i == j:
-                continue
-            distances[i, j] = distances[j, i] = distance_metric(results[i], results[j])
+    if neighbours is not None:
+        index = PairDistanceIndex(len(results), *neighbours, local_scope_sens)
+        return MergeEngine(results, criterion, index, union_function).run()
 
-    while True:
-        changed = False
-        for i in np.where(actual_results)[0]:
-            # actual_results[i] != 0  <=>  results[i] != 0
-            if not actual_results[i]:
-                continue
-            need_to_check = np.where((distances[i] <= local_scope_sens) & actual_results)[0]
-            # индексы, которые нужно просмотреть
-
-            for j in need_to_check:
-                if i == j:
-                    continue
-                if criterion(results[i], results[j], distances[i, j]):
-                    results[i] = union_function(results[i], results[j])
-                    results[j] = None
-                    # обновляем расстояния, т.к. теперь i, j -- эквивалентны
-                    distances[i] = distances[j] = np.minimum(distances[i], distances[j])
-                    distances[:, i] = distances[:, j] = distances[i]
-                    actual_results[j] = False
-
-                    changed = True
-                else:
-                    j += 1
-            i += 1
+    if distance_metric is None:
+        distance_metric = Rect.distance
+        if bbox_function is None:
+            bbox_function = lambda a: a
 
-        if not changed:
-            break
-    return [r for r in results if not (r is None)]
+    index = make_distance_index(results, distance_metric, local_scope_sens, bbox_function)
+    return MergeEngine(results, criterion, index, union_function).run()
@@ -1,6 +1,7 @@
 from __future__ import annotations
 from typing import *
 from math import sqrt
+import numpy as np
 
 
 def len_of_intersection(a1: int, a2: int, b1: int, b2: int) -> int:
@@ -229,5 +230,171 @@ class Rect:
         return intersection.area() / (self.area() + other.area() - intersection.area())
 
 
+class RectArray:
+    """
+    Набор прямоугольников в виде массива (n, 4) int32 со столбцами left, top, right, bottom. Векторизованные
+    операции повторяют семантику соответствующих методов Rect (включая вычисление Rect.distance через центры);
+    аргумент other -- либо Rect (результат -- массив (n,)), либо RectArray из m прямоугольников (результат -- (n, m));
+    при outer=False наборы одинаковой длины сравниваются поэлементно (результат -- (n,))
+    """
+
+    coords: np.ndarray
+
+    LEFT, TOP, RIGHT, BOTTOM = range(4)
+
+    def __init__(self, coords: np.ndarray):
+        self.coords = np.asarray(coords, dtype=np.int32).reshape((-1, 4))
+
+    @staticmethod
+    def from_rects(rects: Iterable[Rect]) -> RectArray:
+        return RectArray(np.array([(r.left(), r.top(), r.right(), r.bottom()) for r in rects], dtype=np.int32))
+
+    @staticmethod
+    def from_text_blocks(blocks: Iterable) -> RectArray:
+        return RectArray.from_rects(tb.zone for tb in blocks)
+
+    def to_rects(self) -> List[Rect]:
+        return [Rect(Point(l, t), Point(r, b)) for l, t, r, b in self.coords.tolist()]
+
+    def to_text_blocks(self, img: np.ndarray) -> List:
+        # блоки с содержимым -- фрагментами img внутри прямоугольников (без копирования)
+        from utils.TextBlock import TextBlock
+        return [TextBlock(rect, img[rect.top(): rect.bottom() + 1, rect.left(): rect.right() + 1])
+                for rect in self.to_rects()]
+
+    def __len__(self) -> int:
+        return self.coords.shape[0]
+
+    def __getitem__(self, item) -> Union[Rect, RectArray]:
+        # целый индекс -- отдельный Rect, срез, маска или массив индексов -- RectArray
+        if isinstance(item, (int, np.integer)):
+            l, t, r, b = self.coords[item].tolist()
+            return Rect(Point(l, t), Point(r, b))
+        return RectArray(self.coords[item])
+
+    def left(self) -> np.ndarray:
+        return self.coords[:, RectArray.LEFT]
+
+    def top(self) -> np.ndarray:
+        return self.coords[:, RectArray.TOP]
+
+    def right(self) -> np.ndarray:
+        return self.coords[:, RectArray.RIGHT]
+
+    def bottom(self) -> np.ndarray:
+        return self.coords[:, RectArray.BOTTOM]
+
+    def w(self) -> np.ndarray:
+        return self.right() - self.left()
+
+    def h(self) -> np.ndarray:
+        return self.bottom() - self.top()
+
+    def area(self) -> np.ndarray:
+        return RectArray._area(self.left(), self.top(), self.right(), self.bottom())
+
+    @staticmethod
+    def _area(l, t, r, b) -> np.ndarray:
+        # площадь в int64, чтобы не переполнить int32 на больших страницах
+        return np.asarray(r - l, dtype=np.int64) * (b - t)
+
+    def center(self) -> np.ndarray:
+        # (n, 2): x, y центров; как в Rect.center, половины сторон отбрасывают дробную часть
+        return np.stack([self.left() + np.trunc(self.w() / 2).astype(np.int32),
+                         self.top() + np.trunc(self.h() / 2).astype(np.int32)], axis=1)
+
+    def _columns(self, other: Union[Rect, RectArray], outer: bool = True) \
+            -> Tuple[Tuple[np.ndarray, ...], Tuple[np.ndarray, ...]]:
+        # left, top, right, bottom обоих наборов, согласованные для broadcasting
+        if isinstance(other, Rect):
+            mine = tuple(self.coords[:, k] for k in range(4))
+            theirs = other.left(), other.top(), other.right(), other.bottom()
+        elif not outer:
+            mine = tuple(self.coords[:, k] for k in range(4))
+            theirs = tuple(other.coords[:, k] for k in range(4))
+        else:
+            mine = tuple(self.coords[:, k, None] for k in range(4))
+            theirs = tuple(other.coords[None, :, k] for k in range(4))
+        return mine, theirs
+
+    @staticmethod
+    def _segments_intersect(a1, a2, b1, b2) -> np.ndarray:
+        return ((a1 <= b1) & (b1 <= a2)) | ((a1 <= b2) & (b2 <= a2)) | \
+               ((b1 <= a1) & (a1 <= b2)) | ((b1 <= a2) & (a2 <= b2))
+
+    def intersects_x(self, other: Union[Rect, RectArray], outer: bool = True) -> np.ndarray:
+        (l1, _, r1, _), (l2, _, r2, _) = self._columns(other, outer)
+        return RectArray._segments_intersect(l1, r1, l2, r2)
+
+    def intersects_y(self, other: Union[Rect, RectArray], outer: bool = True) -> np.ndarray:
+        (_, t1, _, b1), (_, t2, _, b2) = self._columns(other, outer)
+        return RectArray._segments_intersect(t1, b1, t2, b2)
+
+    def intersects(self, other: Union[Rect, RectArray], outer: bool = True) -> np.ndarray:
+        return self.intersects_x(other, outer) & self.intersects_y(other, outer)
+
+    def distance(self, other: Union[Rect, RectArray], outer: bool = True) -> np.ndarray:
+        # Rect.distance(self[i], other) (или Rect.distance(self[i], other[j]), или Rect.distance(self[i], other[i]))
+        (l1, t1, r1, b1), (l2, t2, r2, b2) = self._columns(other, outer)
+        w1, h1, w2, h2 = r1 - l1, b1 - t1, r2 - l2, b2 - t2
+        cx1, cy1 = l1 + np.trunc(w1 / 2), t1 + np.trunc(h1 / 2)
+        cx2, cy2 = l2 + np.trunc(w2 / 2), t2 + np.trunc(h2 / 2)
+        sx, sy = np.sign(cx1 - cx2), np.sign(cy1 - cy2)
+
+        # расстояния между ближайшими сторонами по каждой из осей, как в Rect.distance
+        dx = (cx1 - w1 / 2 * sx) - (cx2 + w2 / 2 * sx)
+        dy = (cy1 - h1 / 2 * sy) - (cy2 + h2 / 2 * sy)
+
+        ix = RectArray._segments_intersect(l1, r1, l2, r2)
+        iy = RectArray._segments_intersect(t1, b1, t2, b2)
+        res = np.where(ix, np.abs(dy), np.where(iy, np.abs(dx), np.sqrt(dx * dx + dy * dy)))
+        res[ix & iy] = 0
+        return res
+
+    def pairwise_distance(self) -> np.ndarray:
+        # (n, n): матрица Rect.distance между всеми парами прямоугольников набора
+        return self.distance(self)
+
+    def intersection_area(self, other: Union[Rect, RectArray], outer: bool = True) -> np.ndarray:
+        (l1, t1, r1, b1), (l2, t2, r2, b2) = self._columns(other, outer)
+        w = np.minimum(r1, r2) - np.maximum(l1, l2)
+        h = np.minimum(b1, b2) - np.maximum(t1, t2)
+        return np.where(self.intersects(other, outer), RectArray._area(0, 0, w, h), 0)
+
+    def iou(self, other: Union[Rect, RectArray], outer: bool = True) -> np.ndarray:
+        # Rect.iou_val; там, где Rect.iou_val делил бы на 0 (вырожденные прямоугольники), -- nan
+        (l1, t1, r1, b1), (l2, t2, r2, b2) = self._columns(other, outer)
+        inter = self.intersection_area(other, outer)
+        union_area = RectArray._area(l1, t1, r1, b1) + RectArray._area(l2, t2, r2, b2) - inter
+        with np.errstate(divide='ignore', invalid='ignore'):
+            res = np.where(union_area != 0, inter / np.where(union_area != 0, union_area, 1), np.nan)
+
+        res = np.where(self.intersects(other, outer), res, 0.)
+        equal = (l1 == l2) & (t1 == t2) & (r1 == r2) & (b1 == b2)
+        return np.where(equal, 1., res)
+
+    def union(self, other: Union[Rect, RectArray], outer: bool = True) -> RectArray:
+        # self[i].union(other) (или self[i].union(other[i]) при outer=False); для RectArray из m прямоугольников
+        # при outer=True -- n * m прямоугольников: self[i].union(other[j]) стоит на месте i * m + j
+        (l1, t1, r1, b1), (l2, t2, r2, b2) = self._columns(other, outer)
+        coords = np.stack(np.broadcast_arrays(np.minimum(l1, l2), np.minimum(t1, t2),
+                                              np.maximum(r1, r2), np.maximum(b1, b2)), axis=-1)
+        return RectArray(coords)
+
+    def union_all(self) -> Rect:
+        # Rect.union_of_rects
+        return Rect(Point(int(self.left().min()), int(self.top().min())),
+                    Point(int(self.right().max()), int(self.bottom().max())))
+
+    def contains_point(self, x: int, y: int) -> np.ndarray:
+        # Point(x, y) in self[i]
+        return (self.left() <= x) & (x <= self.right()) & (self.top() <= y) & (y <= self.bottom())
+
+    def contains(self, other: Union[Rect, RectArray], outer: bool = True) -> np.ndarray:
+        # прямоугольник other (other[j]) целиком лежит в self[i]
+        (l1, t1, r1, b1), (l2, t2, r2, b2) = self._columns(other, outer)
+        return (l1 <= l2) & (r2 <= r1) & (t1 <= t2) & (b2 <= b1)
+
+
 if __name__ == '__main__':
     print(len_of_intersection(1, 4, -2, 3))
@@ -0,0 +1,168 @@
+from typing import *
+import cv2
+import numpy as np
+from utils.ComponentStore import ComponentStore
+from utils.RLEPage import RLEPage
+from utils.BitPage import BitPage
+
+
+def _as_mask(img: np.ndarray) -> np.ndarray:
+    # cv2 работает с uint8; бинарный документ (1 -- пиксел закрашен) обычно уже в этом формате
+    if img.dtype == np.uint8:
+        return img
+    return (img != 0).astype(np.uint8)
+
+
+def _join_neighbourhood(mask: np.ndarray, sensitivity: int) -> np.ndarray:
+    # пикселы p, q смежны, если max(|dx|, |dy|) <= sensitivity. Если "растянуть" каждый пиксел в квадрат
+    # sensitivity x sensitivity вправо-вниз, то квадраты p и q окажутся 8-смежными ровно в этом случае;
+    # рамка справа и снизу нужна, чтобы растянутые пикселы не обрезались краем изображения
+    k = sensitivity
+    padded = cv2.copyMakeBorder(mask, 0, k - 1, 0, k - 1, cv2.BORDER_CONSTANT, value=0)
+    return cv2.dilate(padded, np.ones((k, k), dtype=np.uint8), anchor=(k - 1, k - 1))
+
+
+def label_components(img: np.ndarray, sensitivity: int = 1) -> Tuple[int, np.ndarray]:
+    """
+    Разметка компонент связности бинарного изображения (аналог графа пикселов с окрестностью радиуса sensitivity,
+    см. Segmentator.get_pixel_area)
+
+    :param img: бинарное изображение: 1, если пиксел закрашен, иначе 0
+    :param sensitivity: радиус окрестности: пикселы смежны, если max(|dx|, |dy|) <= sensitivity
+    :return: количество компонент (включая фон) и матрица меток той же формы, что img; фон помечен 0
+    """
+
+    mask = _as_mask(img)
+    h, w = mask.shape
+    sensitivity = max(1, int(sensitivity))
+
+    if sensitivity == 1:
+        return cv2.connectedComponents(mask, connectivity=8, ltype=cv2.CV_32S)
+
+    n, labels = cv2.connectedComponents(_join_neighbourhood(mask, sensitivity), connectivity=8, ltype=cv2.CV_32S)
+    labels = labels[:h, :w]
+    labels[mask == 0] = 0
+    return n, labels
+
+
+def find_component_store(img: np.ndarray, sensitivity: int = 1) -> ComponentStore:
+    """
+    Компоненты связности img (см. label_components) вместе с их пикселами в виде ComponentStore
+
+    :param img: бинарное изображение: 1, если пиксел закрашен, иначе 0
+    :param sensitivity: радиус окрестности: пикселы смежны, если max(|dx|, |dy|) <= sensitivity
+    :return: хранилище пикселов компонент; компонента i -- пикселы с меткой i + 1
+    """
+
+    n, labels = label_components(img, sensitivity)
+    return ComponentStore.from_labels(labels, n)
+
+
+def find_components_borders(img: Union[np.ndarray, RLEPage, BitPage], sensitivity: int = 1) -> np.ndarray:
+    """
+    Находит прямоугольники, описанные вокруг компонент связности img, без построения графа пикселов
+
+    :param img: бинарное изображение: 1, если пиксел закрашен, иначе 0; или страница в формате RLEPage, BitPage
+    :param sensitivity: радиус окрестности: пикселы смежны, если max(|dx|, |dy|) <= sensitivity
+    :return: массив (n, 4) строк (min_x, min_y, max_x, max_y); компоненты упорядочены по их первым пикселам при
+    обходе изображения по строкам (как в графе пикселов Segmentator и в RLEPage.components_borders)
+    """
+
+    if isinstance(img, RLEPage):
+        # разметка по сериям, без перехода к плотной матрице
+        return img.components_borders(sensitivity)
+    if isinstance(img, BitPage):
+        img = img.to_dense()
+
+    mask = _as_mask(img)
+    sensitivity = max(1, int(sensitivity))
+    if sensitivity > 1:
+        mask = _join_neighbourhood(mask, sensitivity)
+
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8, ltype=cv2.CV_32S)
+    return _borders_from_stats(stats, sensitivity)[_raster_order(labels, n)]
+
+
+def _raster_order(labels: np.ndarray, n: int) -> np.ndarray:
+    # номера компонент (без фона) по возрастанию их первых пикселов при обходе по строкам: OpenCV обходит
+    # изображение блоками 2 x 2 и нумерует компоненты в другом порядке, а от порядка зависит postprocess_segmentation.
+    # У растянутых пикселов (см. _join_neighbourhood) первый пиксел компоненты -- ее первый закрашенный пиксел
+    flat = labels.reshape((-1,))
+    ink = np.flatnonzero(flat)
+    first = np.full((n,), flat.size, dtype=np.int64)
+    np.minimum.at(first, flat[ink], ink)
+    return np.argsort(first[1:], kind='stable')
+
+
+def _borders_from_stats(stats: np.ndarray, sensitivity: int = 1) -> np.ndarray:
+    stats = stats[1:]  # нулевая метка -- фон
+
+    res = np.empty((len(stats), 4), dtype=np.int32)
+    res[:, 0] = stats[:, cv2.CC_STAT_LEFT]
+    res[:, 1] = stats[:, cv2.CC_STAT_TOP]
+    # растянутые пикселы выступают на sensitivity - 1 вправо и вниз, это нужно вычесть
+    res[:, 2] = res[:, 0] + stats[:, cv2.CC_STAT_WIDTH] - sensitivity
+    res[:, 3] = res[:, 1] + stats[:, cv2.CC_STAT_HEIGHT] - sensitivity
+    return res
+
+
+# соседние пикселы (dy, dx); каждая пара соседей рассматривается один раз
+_NEIGHBOUR_SHIFTS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+
+def find_close_components(img: np.ndarray, max_dist: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Находит компоненты связности img и все пары компонент, лежащих не дальше max_dist друг от друга, за один проход
+    преобразования расстояний по всему изображению, без попарного сравнения компонент.
+    Каждый пустой пиксел помечается ближайшим к нему закрашенным пикселом; на границе областей двух компонент
+    соседние пикселы p, q дают пару закрашенных пикселов этих компонент, расстояние между которыми -- оценка сверху
+    расстояния между компонентами; для каждой пары компонент берется минимум таких оценок (ближайшие пикселы двух
+    компонент, если между ними нет третьей, лежат по разные стороны границы их областей, поэтому минимум почти
+    всегда точный). Пары, области которых не соприкасаются (их заслоняет третья компонента), не находятся
+
+    :param img: бинарное изображение: 1, если пиксел закрашен, иначе 0
+    :param max_dist: максимальное расстояние между компонентами, которые попадут в список пар
+    :return: прямоугольники компонент (n, 4) -- (min_x, min_y, max_x, max_y); пары номеров компонент (m, 2), i < j;
+    расстояния между компонентами каждой пары (m,)
+    """
+
+    mask = _as_mask(img)
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8, ltype=cv2.CV_32S)
+    borders = _borders_from_stats(stats)
+
+    # номер ближайшего закрашенного пиксела (у закрашенных пикселов -- свой собственный)
+    _, nearest = cv2.distanceTransformWithLabels((mask == 0).astype(np.uint8), cv2.DIST_L2, cv2.DIST_MASK_5,
+                                                 labelType=cv2.DIST_LABEL_PIXEL)
+    ink_y, ink_x = np.nonzero(mask)
+    ink_ids = nearest[ink_y, ink_x]
+    # номер закрашенного пиксела -> его компонента (без фона) и координаты
+    to_component = np.zeros((int(nearest.max()) + 1,), dtype=np.int32)
+    site_y, site_x = np.zeros_like(to_component), np.zeros_like(to_component)
+    to_component[ink_ids], site_y[ink_ids], site_x[ink_ids] = labels[ink_y, ink_x] - 1, ink_y, ink_x
+    component = to_component[nearest]
+
+    keys, ds = [], []
+    h, w = mask.shape
+    for dy, dx in _NEIGHBOUR_SHIFTS:
+        # p = (y, x), q = (y + dy, x + dx) для всех p, у которых q внутри изображения
+        xs_p = slice(max(0, -dx), w - max(0, dx))
+        xs_q = slice(max(0, dx), w - max(0, -dx))
+        cp, cq = component[: h - dy, xs_p], component[dy:, xs_q]
+        # границы областей компонент занимают малую долю страницы: расстояния считаются только на них
+        ys, xs = np.nonzero(cp != cq)
+        cp, cq = cp[ys, xs].astype(np.int64), cq[ys, xs].astype(np.int64)
+        sp, sq = nearest[: h - dy, xs_p][ys, xs], nearest[dy:, xs_q][ys, xs]
+        d = np.hypot(site_y[sp] - site_y[sq], site_x[sp] - site_x[sq])
+        selected = d <= max_dist
+        cp, cq = cp[selected], cq[selected]
+        keys.append(np.minimum(cp, cq) * n + np.maximum(cp, cq))
+        ds.append(d[selected])
+
+    keys, ds = np.concatenate(keys), np.concatenate(ds).astype(np.float64)
+    # для каждой пары компонент -- минимальная оценка
+    order = np.lexsort((ds, keys))
+    keys, first = np.unique(keys[order], return_index=True)
+    ds = ds[order][first]
+
+    pairs = np.stack([keys // n, keys % n], axis=1)
+    return borders, pairs, ds
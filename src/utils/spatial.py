@@ -0,0 +1,272 @@
+from __future__ import annotations
+from typing import *
+from math import floor
+import numpy as np
+from utils.geometry import Rect, RectArray
+
+DENSE_INDEX_MAX_SIZE = 64  # до такого числа объектов выгоднее держать полную матрицу расстояний
+
+
+class RectGrid:
+    """
+    Равномерная сетка над прямоугольниками: каждая ячейка хранит номера прямоугольников, которые ее задевают.
+    Позволяет найти все прямоугольники, лежащие не дальше radius от данного, не перебирая все пары
+    """
+
+    cell_size: float
+    cells: Dict[Tuple[int, int], Set[int]]
+    rects: Dict[int, Rect]
+
+    def __init__(self, cell_size: float, rects: Optional[Iterable[Rect]] = None):
+        self.cell_size = max(float(cell_size), 1.)
+        self.cells = {}
+        self.rects = {}
+        if rects is not None:
+            for i, rect in enumerate(rects):
+                self.insert(i, rect)
+
+    def __len__(self) -> int:
+        return len(self.rects)
+
+    @staticmethod
+    def _bounds(rect: Rect) -> Tuple[int, int, int, int]:
+        # left, top, right, bottom описанного прямоугольника; у перевернутых прямоугольников (left > right или
+        # top > bottom, их дает, например, SegAnalyzer.trivial_parse) углы меняются местами: Rect.distance до них
+        # не меньше расстояния до такого описанного прямоугольника
+        (l, r), (t, b) = sorted((rect.left(), rect.right())), sorted((rect.top(), rect.bottom()))
+        return l, t, r, b
+
+    def _cells_of(self, left: float, top: float, right: float, bottom: float) -> Iterator[Tuple[int, int]]:
+        c = self.cell_size
+        for cy in range(floor(top / c), floor(bottom / c) + 1):
+            for cx in range(floor(left / c), floor(right / c) + 1):
+                yield cx, cy
+
+    def insert(self, i: int, rect: Rect) -> None:
+        self.rects[i] = rect
+        for cell in self._cells_of(*RectGrid._bounds(rect)):
+            self.cells.setdefault(cell, set()).add(i)
+
+    def remove(self, i: int) -> None:
+        rect = self.rects.pop(i)
+        for cell in self._cells_of(*RectGrid._bounds(rect)):
+            ids = self.cells[cell]
+            ids.discard(i)
+            if not ids:
+                del self.cells[cell]
+
+    def update(self, i: int, rect: Rect) -> None:
+        # прямоугольник i изменился (например, его объединили с другим)
+        self.remove(i)
+        self.insert(i, rect)
+
+    def query(self, rect: Rect, radius: float) -> Set[int]:
+        # номера всех прямоугольников, задевающих rect, расширенный на radius во все стороны (надмножество
+        # прямоугольников, расстояние до которых не больше radius)
+        res = set()
+        cells = self.cells
+        left, top, right, bottom = RectGrid._bounds(rect)
+        for cell in self._cells_of(left - radius, top - radius, right + radius, bottom + radius):
+            ids = cells.get(cell)
+            if ids:
+                res |= ids
+
+        return res
+
+
+class DenseDistanceIndex:
+    """
+    Индекс расстояний между объектами сегментации на основе полной матрицы расстояний; при объединении объектов
+    расстояние от объединения до остальных -- минимум расстояний от его частей
+    """
+
+    local_scope_sens: float
+    distances: np.ndarray
+    active: np.ndarray
+
+    def __init__(self, items: List, distance_metric: Callable[[Any, Any], float], local_scope_sens: float):
+        n = len(items)
+        self.local_scope_sens = local_scope_sens
+        self.active = np.ones((n,), dtype=bool)
+        if distance_metric is Rect.distance:
+            # вся матрица -- одним векторизованным вызовом
+            self.distances = RectArray.from_rects(items).pairwise_distance()
+            return
+
+        self.distances = np.zeros((n, n))
+        for i in range(n):
+            for j in range(i + 1, n):
+                self.distances[i, j] = self.distances[j, i] = distance_metric(items[i], items[j])
+
+    def candidates(self, i: int) -> List[int]:
+        # активные объекты в пределах local_scope_sens от i, по возрастанию номеров
+        need_to_check = np.where((self.distances[i] <= self.local_scope_sens) & self.active)[0]
+        return [j for j in need_to_check.tolist() if j != i]
+
+    def distance(self, i: int, j: int) -> float:
+        return self.distances[i, j]
+
+    def merge(self, i: int, j: int, merged: Any = None) -> None:
+        # объект j присоединен к i, merged -- их объединение; теперь i, j -- эквивалентны
+        distances = self.distances
+        distances[i] = distances[j] = np.minimum(distances[i], distances[j])
+        distances[:, i] = distances[:, j] = distances[i]
+        self.active[j] = False
+
+
+class PairDistanceIndex:
+    """
+    Разреженный индекс расстояний по заранее найденным парам близких объектов (например, см.
+    utils.labeling.find_close_components): для каждого объекта хранятся только соседи в пределах local_scope_sens.
+    При объединении объектов списки соседей сливаются, как строки матрицы в DenseDistanceIndex
+    """
+
+    local_scope_sens: float
+    neighbours: List[Optional[Dict[int, float]]]  # neighbours[i][j] -- расстояние между i и j; None -- i поглощен
+
+    def __init__(self, n: int, pairs: Iterable[Tuple[int, int]], distances: Iterable[float], local_scope_sens: float):
+        self.local_scope_sens = local_scope_sens
+        neighbours = [{} for _ in range(n)]
+        for (i, j), d in zip(pairs, distances):
+            if d <= local_scope_sens and d < neighbours[i].get(j, d + 1):
+                neighbours[i][j] = neighbours[j][i] = d
+
+        self.neighbours = neighbours
+
+    def candidates(self, i: int) -> List[int]:
+        return sorted(self.neighbours[i].keys())
+
+    def distance(self, i: int, j: int) -> float:
+        return self.neighbours[i][j]
+
+    def merge(self, i: int, j: int, merged: Any = None) -> None:
+        neighbours = self.neighbours
+        ni, nj = neighbours[i], neighbours[j]
+        del ni[j]
+        for k, d in nj.items():
+            if k == i:
+                continue
+            nk = neighbours[k]
+            del nk[j]
+            if d < ni.get(k, d + 1):
+                ni[k] = nk[i] = d
+
+        neighbours[j] = None
+
+
+class GridDistanceIndex(PairDistanceIndex):
+    """
+    Разреженный индекс расстояний, пары близких объектов для которого находятся через RectGrid по описанным
+    прямоугольникам объектов, поэтому distance_metric должна быть не меньше расстояния между описанными
+    прямоугольниками (с точностью до пиксела)
+    """
+
+    def __init__(self, items: List, distance_metric: Callable[[Any, Any], float], local_scope_sens: float,
+                 bbox_function: Callable[[Any], Rect]):
+        rects = [bbox_function(item) for item in items]
+        grid = RectGrid(local_scope_sens, rects)
+        # погрешность Rect.distance при вычислении через центры -- не больше пиксела
+        radius = local_scope_sens + 1
+
+        pairs = [(i, j) for i in range(len(items)) for j in grid.query(rects[i], radius) if j > i]
+        if distance_metric is Rect.distance:
+            # для прямоугольников все пары-кандидаты оцениваются одним векторизованным вызовом
+            rect_array = RectArray.from_rects(rects)
+            idx = np.array(pairs, dtype=np.int64).reshape((-1, 2))
+            ds = rect_array[idx[:, 0]].distance(rect_array[idx[:, 1]], outer=False).tolist()
+        else:
+            ds = [distance_metric(items[i], items[j]) for i, j in pairs]
+
+        super().__init__(len(items), pairs, ds, local_scope_sens)
+
+
+class RectDistanceIndex:
+    """
+    Индекс над изменяющимися прямоугольниками: расстояние между объектами -- это distance_metric между их текущими
+    (объединенными) прямоугольниками, а сетка обновляется при каждом объединении
+    """
+
+    local_scope_sens: float
+    rects: List[Optional[Rect]]
+    grid: RectGrid
+
+    def __init__(self, rects: List[Rect], local_scope_sens: float,
+                 distance_metric: Callable[[Rect, Rect], float] = Rect.distance):
+        self.local_scope_sens = local_scope_sens
+        self.distance_metric = distance_metric
+        self.rects = list(rects)
+        self.grid = RectGrid(local_scope_sens, self.rects)
+        self._last_query: Tuple[int, Dict[int, float]] = (-1, {})  # расстояния, найденные последним candidates
+
+    def candidates(self, i: int) -> List[int]:
+        rects, metric, sens = self.rects, self.distance_metric, self.local_scope_sens
+        found = {}
+        for j in self.grid.query(rects[i], sens + 1):
+            if j != i:
+                d = metric(rects[i], rects[j])
+                if d <= sens:
+                    found[j] = d
+
+        self._last_query = (i, found)
+        return sorted(found.keys())
+
+    def distance(self, i: int, j: int) -> float:
+        qi, found = self._last_query
+        if qi == i and j in found:
+            return found[j]
+        return self.distance_metric(self.rects[i], self.rects[j])
+
+    def merge(self, i: int, j: int, merged: Rect = None) -> None:
+        self.grid.remove(j)
+        self.rects[j] = None
+        self.rects[i] = merged
+        self.grid.update(i, merged)
+        self._last_query = (-1, {})
+
+
+class IntervalChainIndex:
+    """
+    Индекс над упорядоченными непересекающимися отрезками (например, строками текста (top, bottom)): соседями
+    считаются только ближайшие отрезки сверху и снизу, расстояние -- промежуток между ними
+    """
+
+    intervals: List[Optional[Tuple[int, int]]]
+    prev: List[int]  # номер ближайшего активного отрезка сверху (-1, если его нет)
+    next: List[int]  # номер ближайшего активного отрезка снизу (-1, если его нет)
+
+    def __init__(self, intervals: List[Tuple[int, int]]):
+        n = len(intervals)
+        self.intervals = list(intervals)
+        self.prev = list(range(-1, n - 1))
+        self.next = [j if j < n else -1 for j in range(1, n + 1)]
+
+    def candidates(self, i: int) -> List[int]:
+        return [j for j in (self.prev[i], self.next[i]) if j != -1]
+
+    def distance(self, i: int, j: int) -> float:
+        (ta, ba), (tb, bb) = sorted((self.intervals[i], self.intervals[j]))
+        return tb - ba
+
+    def merge(self, i: int, j: int, merged: Tuple[int, int] = None) -> None:
+        # j -- сосед i, после удаления j из цепочки соседом i становится следующий за j отрезок
+        prev, next = self.prev, self.next
+        if next[i] == j:
+            next[i] = next[j]
+            if next[j] != -1:
+                prev[next[j]] = i
+        else:
+            prev[i] = prev[j]
+            if prev[j] != -1:
+                next[prev[j]] = i
+
+        self.intervals[i] = merged
+        self.intervals[j] = None
+
+
+def make_distance_index(items: List, distance_metric: Callable[[Any, Any], float], local_scope_sens: float,
+                        bbox_function: Optional[Callable[[Any], Rect]] = None) \
+        -> Union[DenseDistanceIndex, GridDistanceIndex]:
+    # для небольшого количества объектов или объектов без известного описанного прямоугольника -- полная матрица
+    if bbox_function is None or len(items) <= DENSE_INDEX_MAX_SIZE:
+        return DenseDistanceIndex(items, distance_metric, local_scope_sens)
+    return GridDistanceIndex(items, distance_metric, local_scope_sens, bbox_function)
@@ -0,0 +1,117 @@
+from __future__ import annotations
+from typing import *
+from math import isqrt
+import numpy as np
+from utils.geometry import RectArray
+from utils.algs import DisjointSet
+
+DEFAULT_MEMORY_BUDGET = 64 << 20  # байт рабочей памяти на обработку одного фрагмента
+BYTES_PER_PIXEL = 64  # оценка сверху рабочей памяти на пиксел фрагмента: таблицы сумм int64 и вещественные
+# средние/отклонения LocalThreshold, метки компонент int32, таблица сумм SegAnalyzer
+TILE_ALIGN = 8  # границы фрагментов кратны 8 по x, чтобы фрагменты BitPage не приходилось сдвигать по битам
+
+
+class Tile:
+    # фрагмент страницы: core -- его собственная часть (фрагменты покрывают страницу без пересечений),
+    # ext -- core, расширенная на поле halo в пределах страницы; оба -- (y0, y1, x0, x1), концы не включаются
+    core: Tuple[int, int, int, int]
+    ext: Tuple[int, int, int, int]
+
+    def __init__(self, core: Tuple[int, int, int, int], ext: Tuple[int, int, int, int]):
+        self.core, self.ext = core, ext
+
+    def ext_slices(self) -> Tuple[slice, slice]:
+        y0, y1, x0, x1 = self.ext
+        return slice(y0, y1), slice(x0, x1)
+
+    def core_slices(self) -> Tuple[slice, slice]:
+        y0, y1, x0, x1 = self.core
+        return slice(y0, y1), slice(x0, x1)
+
+    def core_in_ext(self) -> Tuple[slice, slice]:
+        # положение core внутри массива, вырезанного по ext
+        (y0, y1, x0, x1), (ey0, _, ex0, _) = self.core, self.ext
+        return slice(y0 - ey0, y1 - ey0), slice(x0 - ex0, x1 - ex0)
+
+
+def tile_side(memory_budget: int, halo: int, bytes_per_pixel: int = BYTES_PER_PIXEL) -> int:
+    """
+    Сторона квадратной core, при которой фрагмент вместе с полем halo укладывается в memory_budget байт
+
+    :param memory_budget: бюджет рабочей памяти на фрагмент, байт
+    :param halo: ширина поля вокруг core
+    :param bytes_per_pixel: рабочая память на пиксел фрагмента
+    :return: сторона, кратная TILE_ALIGN и не меньшая halo (поле фрагмента задевает только соседние фрагменты)
+    """
+
+    side = (isqrt(memory_budget // bytes_per_pixel) - 2 * halo) // TILE_ALIGN * TILE_ALIGN
+    if side <= 0 or side < halo:
+        raise ValueError("Бюджет памяти %d байт слишком мал для поля шириной %d" % (memory_budget, halo))
+    return side
+
+
+def split_into_tiles(shape: Tuple[int, int], side: int, halo: int) -> List[Tile]:
+    # фрагменты страницы shape = (h, w) в порядке обхода по строкам: core -- квадраты side x side (у краев меньше)
+    h, w = shape
+    return [Tile((y0, min(y0 + side, h), x0, min(x0 + side, w)),
+                 (max(0, y0 - halo), min(y0 + side + halo, h), max(0, x0 - halo), min(x0 + side + halo, w)))
+            for y0 in range(0, h, side) for x0 in range(0, w, side)]
+
+
+def reconcile_tile_boxes(tiles: List[Tile], shape: Tuple[int, int], boxes: List[RectArray],
+                         same_ratio: float = 0.5) -> RectArray:
+    """
+    Сводит прямоугольники, найденные сегментацией отдельных фрагментов (по ext), в один набор для всей страницы.
+    Каждое слово берется из одного фрагмента -- того, core которого содержит центр прямоугольника слова: если
+    поле фрагмента шире половины слова вместе с расстоянием, на котором сегментатор объединяет компоненты, фрагмент
+    видит слово с окрестностью целиком и разбивает его так же, как вся страница; прямоугольники того же слова из
+    других фрагментов отбрасываются.
+    Прямоугольники, обрезанные краем ext, -- части объектов, не поместившихся в поле (линии, края листа). Две такие
+    части соседних фрагментов считаются одним объектом, если в общей части их ext они совпадают (IoU не меньше
+    same_ratio); части одного объекта объединяются, и объединение остается, если центр хотя бы одной из них лежит
+    в core своего фрагмента. Для таких объектов результат может отличаться от сегментации всей страницы: критерий
+    объединения видит их обрезанными. Пустые (вывернутые) прямоугольники, которые иногда возвращает сегментатор,
+    отбрасываются
+
+    :param tiles: фрагменты (см. split_into_tiles)
+    :param shape: (h, w) страницы
+    :param boxes: boxes[i] -- прямоугольники фрагмента tiles[i] в координатах страницы
+    :param same_ratio: IoU частей в общей части ext, начиная с которого они считаются одним объектом
+    :return: прямоугольники страницы
+    """
+
+    h, w = shape
+    kept, parts, parts_owned = [], [], []
+    for tile, rects in zip(tiles, boxes):
+        (y0, y1, x0, x1), (ey0, ey1, ex0, ex1) = tile.core, tile.ext
+        rects = rects[(rects.left() <= rects.right()) & (rects.top() <= rects.bottom())]
+        l, t, r, b = rects.left(), rects.top(), rects.right(), rects.bottom()
+        cx, cy = (l + r) // 2, (t + b) // 2
+
+        owned = (x0 <= cx) & (cx < x1) & (y0 <= cy) & (cy < y1)
+        cut = ((l <= ex0) & (ex0 > 0)) | ((r >= ex1 - 1) & (ex1 < w)) | \
+            ((t <= ey0) & (ey0 > 0)) | ((b >= ey1 - 1) & (ey1 < h))
+        kept.append(rects.coords[owned & ~cut])
+        parts.append(rects.coords[cut])
+        parts_owned.append(owned[cut])
+
+    offsets = np.cumsum([0] + [len(coords) for coords in parts])
+    all_parts, parts_owned = RectArray(np.concatenate(parts)), np.concatenate(parts_owned)
+
+    # части соседних фрагментов (ext которых пересекаются), совпадающие в общей части ext
+    ds = DisjointSet(len(all_parts))
+    for i in range(len(tiles)):
+        for j in range(i + 1, len(tiles)):
+            (ay0, ay1, ax0, ax1), (by0, by1, bx0, bx1) = tiles[i].ext, tiles[j].ext
+            oy0, oy1, ox0, ox1 = max(ay0, by0), min(ay1, by1), max(ax0, bx0), min(ax1, bx1)
+            if oy0 >= oy1 or ox0 >= ox1 or not len(parts[i]) or not len(parts[j]):
+                continue
+            lo, hi = np.array([ox0, oy0, ox0, oy0]), np.array([ox1 - 1, oy1 - 1, ox1 - 1, oy1 - 1])
+            ra, rb = RectArray(np.clip(parts[i], lo, hi)), RectArray(np.clip(parts[j], lo, hi))
+            iou = np.nan_to_num(ra.iou(rb), nan=0.)
+            same = (iou >= same_ratio) | (ra.coords[:, None, :] == rb.coords[None, :, :]).all(axis=2)
+            ia, ib = np.nonzero(same & ra.intersects(rb))
+            ds.union_pairs(zip((offsets[i] + ia).tolist(), (offsets[j] + ib).tolist()))
+
+    merged = [all_parts[group].union_all() for group in ds.groups() if parts_owned[group].any()]
+    return RectArray(np.concatenate(kept + [RectArray.from_rects(merged).coords.reshape((-1, 4))]))